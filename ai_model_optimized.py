@@ -8,47 +8,20 @@ AI模型调用模块 - 教师端专用版本
 """
 
 import os
+import json
 import logging
-from logging.handlers import RotatingFileHandler
-from pathlib import Path
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, Optional
 from openai import OpenAI
+from log_utils import setup_queue_logger
+from json_utils import json_dumps, json_loads
 
 
 # 配置日志
 def setup_ai_logger():
     """配置AI模型日志系统"""
-    log_dir = Path(__file__).parent / "logs"
-    log_dir.mkdir(exist_ok=True)
-
-    logger = logging.getLogger("ai_model")
-    logger.setLevel(logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
-
-    if logger.handlers:
-        return logger
-
-    log_file = log_dir / "ai_model.log"
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
-    return logger
+    return setup_queue_logger("ai_model", "ai_model.log", logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
 
 
 logger = setup_ai_logger()
@@ -68,7 +41,7 @@ class OptimizedAIModel:
        - 薄弱项识别（analyze_with_llm）
     
     使用方式：
-        model = OptimizedAIModel()
+        model = get_ai_model()
         response = model.client.chat.completions.create(
             model=model.model,
             messages=[...],
@@ -84,6 +57,7 @@ class OptimizedAIModel:
         - SILICONFLOW_API_KEY: API密钥
         - SILICONFLOW_BASE_URL: API基础URL
         - SILICONFLOW_MODEL: 模型名称
+        - SILICONFLOW_FAST_MODEL: 轻量任务（如意图识别）使用的模型，默认与SILICONFLOW_MODEL相同
         """
         self.api_key = os.getenv(
             "SILICONFLOW_API_KEY",
@@ -97,6 +71,8 @@ class OptimizedAIModel:
             "SILICONFLOW_MODEL",
             "deepseek-ai/DeepSeek-V3"
         )
+        # 意图识别等输出很短的分类任务可以换用更小更快的模型
+        self.fast_model = os.getenv("SILICONFLOW_FAST_MODEL") or self.model
         
         # 初始化OpenAI客户端
         self.client = OpenAI(
@@ -104,8 +80,116 @@ class OptimizedAIModel:
             base_url=self.base_url
         )
         
-        if os.getenv('DEBUG_AI', '1') == '1':
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"✅ AI模型初始化完成")
             logger.debug(f"   模型: {self.model}")
+            logger.debug(f"   轻量模型: {self.fast_model}")
             logger.debug(f"   Base URL: {self.base_url}")
             logger.debug(f"   API Key: {self.api_key[:20]}...{self.api_key[-10:]}")
+
+
+# 进程级共享实例：OpenAI客户端内部维护HTTP连接池，复用实例即可复用keep-alive连接
+_INSTANCE: Optional[OptimizedAIModel] = None
+_INSTANCE_LOCK = threading.Lock()
+
+
+def get_ai_model() -> OptimizedAIModel:
+    """
+    获取共享的AI模型实例（首次调用时创建）
+
+    避免每个请求都重新构造OptimizedAIModel和底层HTTP客户端，
+    多个请求线程共用同一个连接池。
+    """
+    global _INSTANCE
+    if _INSTANCE is None:
+        with _INSTANCE_LOCK:
+            if _INSTANCE is None:
+                _INSTANCE = OptimizedAIModel()
+    return _INSTANCE
+
+
+class LazyJson:
+    """
+    日志参数的延迟JSON序列化：配合logger的%s占位符使用，
+    只有日志记录真正被输出时才序列化，被级别过滤掉的日志不产生序列化开销
+    """
+
+    __slots__ = ("value", "indent")
+
+    def __init__(self, value: Any, indent: Optional[int] = None):
+        self.value = value
+        self.indent = indent
+
+    def __str__(self) -> str:
+        return json_dumps(self.value, indent=bool(self.indent))
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def extract_json_object(content: str) -> Optional[Dict[str, Any]]:
+    """
+    从大模型响应中截取第一个JSON对象
+
+    先用json_loads按整体解析（json_object模式下的常见情况）；失败时依次从每个"{"开始用raw_decode解析，
+    兼容```json代码块、对象前后的说明文字，正文里出现的"{"或"}"也不会导致截取错位。
+    返回解析出的dict，找不到有效对象时返回None。
+    """
+    try:
+        parsed = json_loads(content)
+        if isinstance(parsed, dict):
+            return parsed
+    except ValueError:
+        pass
+
+    idx = content.find("{")
+    while idx != -1:
+        try:
+            parsed, _ = _JSON_DECODER.raw_decode(content, idx)
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+        idx = content.find("{", idx + 1)
+    return None
+
+
+# 流式输出合并阈值：攒够这么多字符或遇到换行再向下游输出，减少过碎的分块
+# 可通过环境变量STREAM_FLUSH_CHARS调整：调大分块更少、吞吐更高，调小首屏和逐字显示更及时
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "32"))
+# 缓存内容最长停留时间（秒）：模型输出较慢时，攒不够字符也按时输出，避免前端长时间无响应
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+
+
+def iter_stream_text(
+    stream: Iterable[Any],
+    flush_chars: int = STREAM_FLUSH_CHARS,
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+) -> Iterator[str]:
+    """
+    遍历chat.completions流式响应，按块输出文本内容
+
+    单个token会先缓存，缓存中出现换行、长度达到flush_chars，或最早的缓存内容已等待flush_interval秒时一次性输出，
+    流结束时输出剩余内容（等待时间在收到下一个token时检查）。
+    缓存用列表累积、输出时才join，避免逐token字符串拼接。
+    """
+    buf: list = []
+    size = 0
+    started = 0.0
+    for event in stream:
+        if not event.choices:
+            continue
+        content = event.choices[0].delta.content
+        if not content:
+            continue
+        now = time.monotonic()
+        if not buf:
+            started = now
+        buf.append(content)
+        size += len(content)
+        if size >= flush_chars or "\n" in content or now - started >= flush_interval:
+            yield "".join(buf)
+            buf.clear()
+            size = 0
+    if buf:
+        yield "".join(buf)
@@ -3,50 +3,38 @@
 提供API接口供Flask应用调用
 使用大模型进行智能分析
 """
-import pandas as pd
-import json
+from __future__ import annotations
+
 import os
+import hashlib
+import re
+import stat
+import tempfile
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Generator
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional, Generator
 import io
 
-# 配置日志
-def setup_analyzer_logger():
-    """配置分析器日志系统"""
-    log_dir = Path(__file__).parent / "logs"
-    log_dir.mkdir(exist_ok=True)
-
-    logger = logging.getLogger("analyzer")
-    logger.setLevel(logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
-
-    if logger.handlers:
-        return logger
-
-    log_file = log_dir / "analyzer.log"
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
+from log_utils import setup_queue_logger
+from json_utils import json_dumps_bytes, json_loads
 
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只做进程内互斥
+    fcntl = None
 
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+# pandas/numpy体积大、导入慢，只在真正分析数据的函数内按需导入，
+# 只做配置增删查的进程/接口无需加载（多进程池同理，见generate_class_profiles）
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
-    return logger
+# 配置日志
+def setup_analyzer_logger():
+    """配置分析器日志系统"""
+    return setup_queue_logger("analyzer", "analyzer.log", logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
 
 logger = setup_analyzer_logger()
 
@@ -56,6 +44,38 @@ GRADE_MAPPING = {
     19: "6", 20: "7", 21: "8", 22: "9"
 }
 
+# 班级名称中的年级（如"5年级"），模块加载时编译一次
+_GRADE_PATTERN = re.compile(r'(\d+)年级')
+
+# 中文数字到阿拉伯数字的转换表（配合str.translate一次完成全部替换）
+_CN_NUM_TABLE = str.maketrans({
+    '一': '1', '二': '2', '三': '3', '四': '4', '五': '5',
+    '六': '6', '七': '7', '八': '8', '九': '9'
+})
+
+
+def _write_bytes_atomic(path: Path, data: bytes):
+    """
+    原子写文件：先写同目录下的临时文件，再用os.replace替换目标文件
+
+    写入中途崩溃或并发读取时，读到的要么是旧文件要么是完整的新文件，不会是截断的JSON。
+    """
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp创建的文件权限为0600，保持与原文件一致（新文件默认0644）
+        os.chmod(tmp_name, stat.S_IMODE(path.stat().st_mode) if path.exists() else 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
 def extract_grade_from_class_name(class_name: str) -> str:
     """
     从班级名称中提取年级
@@ -72,22 +92,12 @@ def extract_grade_from_class_name(class_name: str) -> str:
     返回:
         年级字符串（如"1"、"5"），如果提取失败返回"1"
     """
-    import re
-
-    # 中文数字到阿拉伯数字的映射
-    cn_num_map = {
-        '一': '1', '二': '2', '三': '3', '四': '4', '五': '5',
-        '六': '6', '七': '7', '八': '8', '九': '9'
-    }
-
     # 先将中文数字转换为阿拉伯数字
-    normalized_name = class_name
-    for cn, num in cn_num_map.items():
-        normalized_name = normalized_name.replace(cn, num)
+    normalized_name = class_name.translate(_CN_NUM_TABLE)
 
     # 使用正则表达式提取年级
     # 匹配模式：数字 + "年级"
-    match = re.search(r'(\d+)年级', normalized_name)
+    match = _GRADE_PATTERN.search(normalized_name)
     if match:
         grade = match.group(1)
         logger.debug(f"从班级名称 '{class_name}' 中提取到年级: {grade}")
@@ -118,24 +128,130 @@ WEAKNESS_MAPPING = {
     # 注意：不包含"身高"和"BMI"，因为标准体测数据中没有"身高等级"和"BMI等级"列
 }
 
-def analyze_student_weaknesses(df: pd.DataFrame) -> Dict[str, List[str]]:
+# 各体测项目在Excel中对应的等级列名（如"50米跑" -> "50米跑等级"），统一在此处生成
+GRADE_COLUMNS = {item: f"{item}等级" for item in WEAKNESS_MAPPING}
+
+# 薄弱维度到体测项目的反向映射（如"耐力" -> ["800米跑", "1000米跑", "50米×8往返跑"]），保持WEAKNESS_MAPPING中的顺序
+DIM_TO_ITEMS: Dict[str, List[str]] = {
+    dimension: [item for item, item_dimension in WEAKNESS_MAPPING.items() if item_dimension == dimension]
+    for dimension in dict.fromkeys(WEAKNESS_MAPPING.values())
+}
+
+
+def _active_items(columns) -> List[Tuple[str, str]]:
+    """返回数据中存在等级列的体测项目 [(项目, 等级列名), ...]，按WEAKNESS_MAPPING顺序；各处循环只需遍历这些项目"""
+    present = set(columns)
+    return [(item, grade_col) for item, grade_col in GRADE_COLUMNS.items() if grade_col in present]
+
+
+# 分析时用到的学生信息列（其余列如原始成绩不参与分析，读取时直接跳过）
+STUDENT_INFO_COLUMNS = ("学生编号", "学号", "编号", "姓名", "班级", "性别", "年龄")
+
+
+def _is_used_column(col) -> bool:
+    """判断Excel列是否参与分析：学生信息列 + 所有"xx等级"列"""
+    col = str(col)
+    return col in STUDENT_INFO_COLUMNS or col.endswith("等级")
+
+
+def read_class_excel(source) -> pd.DataFrame:
     """
-    分析每个学生的薄弱项
+    读取班级体测数据Excel，只保留分析需要的列
 
     参数:
-        df: 体测数据DataFrame
+        source: 文件路径或文件对象（如io.BytesIO）
 
     返回:
-        字典，key为学生姓名，value为薄弱维度列表
+        体测数据DataFrame
     """
-    student_weaknesses = {}
+    import pandas as pd
+
+    if isinstance(source, (str, os.PathLike)):
+        # 一次性读入内存再解析，避免openpyxl在zip各部分间反复小块读取磁盘
+        source = io.BytesIO(Path(source).read_bytes())
+    df = pd.read_excel(source, usecols=_is_used_column)
+
+    # 等级列转成Categorical：后续统计和薄弱判定基于整数编码，不再反复比较字符串
+    # 类别以该项目的固定等级开头（编码与grade_levels顺序一致），表中出现的其他取值追加在后面，原值不丢失
+    for item, grade_col in _active_items(df.columns):
+        levels = grade_levels(item)
+        extras = [value for value in df[grade_col].dropna().unique() if value not in levels]
+        df[grade_col] = pd.Categorical(df[grade_col], categories=[*levels, *extras])
+    return df
+
+
+# 标准体测项目的等级顺序，以及体重项目的等级顺序
+STANDARD_LEVELS = ("优秀", "良好", "及格", "不及格")
+WEIGHT_LEVELS = ("正常", "超重", "肥胖", "低体重")
+
+
+def grade_levels(item: str) -> Tuple[str, ...]:
+    """返回体测项目使用的等级顺序（体重项目使用特殊的分类系统）"""
+    return WEIGHT_LEVELS if item == "体重" else STANDARD_LEVELS
+
+
+# 学生个体薄弱判定：各项目中被视为薄弱的等级
+# 体重等级：只有"正常"才不是薄弱项；其他项目：成绩为"不及格"或"及格"即为薄弱项
+WEAK_WEIGHT_LEVELS = frozenset({"超重", "肥胖", "低体重"})
+WEAK_STANDARD_LEVELS = frozenset({"不及格", "及格"})
+
+
+def compute_grade_stats(df: pd.DataFrame) -> Dict[str, Dict]:
+    """
+    一次遍历统计所有体测项目的等级信息，供班级分析、学生分析和大模型分析共用
+
+    每个等级列按该项目的固定等级转成Categorical，再用np.bincount对类别编码计数，
+    代替基于字符串哈希的value_counts；学生薄弱判定也直接使用同一份类别编码。空值不计入。
+
+    返回:
+        {
+            "counts": 各项目按grade_levels顺序排列的人数数组,
+            "totals": 各项目有效（非空）记录数（包含不在固定等级中的取值）,
+            "weak_masks": 各项目每个学生是否处于薄弱等级的布尔数组（与df行顺序一致）
+        }
+        只包含DataFrame中存在的项目列，按WEAKNESS_MAPPING顺序排列
+    """
+    import numpy as np
+    import pandas as pd
+
+    counts: Dict[str, np.ndarray] = {}
+    totals: Dict[str, int] = {}
+    weak_masks: Dict[str, np.ndarray] = {}
+    for item, grade_col in _active_items(df.columns):
+        column = df[grade_col]
+        levels = grade_levels(item)
+        if isinstance(column.dtype, pd.CategoricalDtype) and tuple(column.cat.categories[:len(levels)]) == levels:
+            # read_class_excel已按固定等级转好类别，直接使用现有编码；追加的其他取值编码>=len(levels)，不计入各等级
+            codes = column.cat.codes.to_numpy()
+            codes = np.where(codes < len(levels), codes, -1)
+        else:
+            codes = pd.Categorical(column, categories=levels).codes
+        counts[item] = np.bincount(codes[codes >= 0], minlength=len(levels))
+        totals[item] = int(column.count())
+        weak_levels = WEAK_WEIGHT_LEVELS if item == "体重" else WEAK_STANDARD_LEVELS
+        weak_masks[item] = np.isin(codes, [code for code, level in enumerate(levels) if level in weak_levels])
+    return {"counts": counts, "totals": totals, "weak_masks": weak_masks}
+
+
+def _student_keys(df: pd.DataFrame) -> List[Tuple[object, object, object]]:
+    """
+    按行计算学生标识，返回 [(学生主键, 学生编号, 姓名), ...]，顺序与df的行一致
 
-    # 遍历每个学生
-    for idx, row in df.iterrows():
-        # 优先使用学生编号作为标识，其次是姓名，最后才是序号
-        # 尝试从多个可能的列获取学生编号
-        student_id = row.get('学生编号', '') or row.get('学号', '') or row.get('编号', '')
-        student_name = row.get('姓名', '')
+    规则与逐行row.get一致：优先使用学生编号（依次尝试"学生编号"/"学号"/"编号"列），
+    其次是姓名，最后才使用序号（"学生{行号+1}"）。
+    只取这几列并转成object数组（与iterrows在含文字列的表上得到的取值类型一致），不为每行构造Series。
+    """
+    key_columns = [col for col in ("学生编号", "学号", "编号", "姓名") if col in df.columns]
+    positions = {col: i for i, col in enumerate(key_columns)}
+    id_positions = [positions.get(col) for col in ("学生编号", "学号", "编号")]
+    name_position = positions.get("姓名")
+    rows = df[key_columns].to_numpy(dtype=object) if key_columns else [()] * len(df)
+
+    keys = []
+    for idx, values in zip(df.index, rows):
+        id_values = [values[pos] if pos is not None else '' for pos in id_positions]
+        student_id = id_values[0] or id_values[1] or id_values[2]
+        student_name = values[name_position] if name_position is not None else ''
 
         if student_id:
             student_key = str(student_id)  # 使用学生编号作为主键
@@ -143,30 +259,48 @@ def analyze_student_weaknesses(df: pd.DataFrame) -> Dict[str, List[str]]:
             student_key = student_name  # 使用姓名作为主键
         else:
             student_key = f'学生{idx+1}'  # 最后才使用序号
+        keys.append((student_key, student_id, student_name))
+    return keys
+
+
+def analyze_student_weaknesses(df: pd.DataFrame, grade_stats: Optional[Dict[str, Dict]] = None) -> Dict[str, List[str]]:
+    """
+    分析每个学生的薄弱项
+
+    参数:
+        df: 体测数据DataFrame
+        grade_stats: compute_grade_stats(df)的结果，已计算过时传入以免重复统计
+
+    返回:
+        字典，key为学生姓名，value为薄弱维度列表
+    """
+    import numpy as np
+
+    if grade_stats is None:
+        grade_stats = compute_grade_stats(df)
+
+    # 按列整体判断每个学生在各维度上是否薄弱（使用全局WEAKNESS_MAPPING），代替逐行逐项目检查
+    dimension_masks = {}
+    for item, mask in grade_stats["weak_masks"].items():
+        dimension = WEAKNESS_MAPPING[item]
+        dimension_masks[dimension] = dimension_masks[dimension] | mask if dimension in dimension_masks else mask
 
-        weaknesses = set()  # 使用集合避免重复
-
-        # 检查每个体测项目（使用全局WEAKNESS_MAPPING）
-        for item, dimension in WEAKNESS_MAPPING.items():
-            grade_col = f"{item}等级"
-            if grade_col in df.columns:
-                grade = row.get(grade_col)
-
-                # 体重等级使用特殊的分类系统
-                if item == "体重":
-                    # 体重等级：正常、超重、肥胖、低体重
-                    # 只有"正常"才不是薄弱项
-                    if grade in ["超重", "肥胖", "低体重"]:
-                        weaknesses.add(dimension)
-                else:
-                    # 其他项目使用标准分类：优秀、良好、及格、不及格
-                    # 如果成绩为"不及格"或"及格"，则该维度为薄弱项
-                    if grade in ["不及格", "及格"]:
-                        weaknesses.add(dimension)
+    # 维度按名称排序后，把每个学生的薄弱维度编码成一个整数位掩码（第i位对应第i个维度）
+    dimensions = sorted(dimension_masks)
+    bits = np.zeros(len(df), dtype=np.int64)
+    for bit, dimension in enumerate(dimensions):
+        bits |= dimension_masks[dimension].astype(np.int64) << bit
 
+    # 同一组合的薄弱维度列表只展开一次（按位从低到高，列表天然有序）
+    combos: Dict[int, List[str]] = {}
+    student_weaknesses = {}
+    for (student_key, _, _), mask in zip(_student_keys(df), bits.tolist()):
         # 只保存有薄弱项的学生
-        if weaknesses:
-            student_weaknesses[student_key] = sorted(list(weaknesses))
+        if mask:
+            combo = combos.get(mask)
+            if combo is None:
+                combo = combos[mask] = [d for bit, d in enumerate(dimensions) if mask >> bit & 1]
+            student_weaknesses[student_key] = list(combo)
 
     return student_weaknesses
 
@@ -188,81 +322,68 @@ def group_students_by_weakness(student_weaknesses: Dict[str, List[str]], df: pd.
     返回:
         分组信息字典，key为薄弱项组合（如"力量"、"速度"、"力量+速度"），value为该组的详细信息
     """
-    groups = {}
+    import pandas as pd
 
     # 如果没有指定班级薄弱项，使用所有薄弱项（兼容旧逻辑）
     if class_weaknesses is None:
         class_weaknesses = list(set([w for weaknesses in student_weaknesses.values() for w in weaknesses]))
-
-    # 遍历每个学生，只看班级薄弱项的表现
-    for idx, row in df.iterrows():
-        # 优先使用学生编号作为标识，其次是姓名，最后才是序号
-        # 尝试从多个可能的列获取学生编号
-        student_id = row.get('学生编号', '') or row.get('学号', '') or row.get('编号', '')
-        student_name = row.get('姓名', '')
-
-        if student_id:
-            student_key = str(student_id)  # 使用学生编号作为主键
-        elif student_name:
-            student_key = student_name  # 使用姓名作为主键
-        else:
-            student_key = f'学生{idx+1}'  # 最后才使用序号
-
-        # 获取学生的详细信息
-        student_info = {
-            "序号": idx + 1,  # 添加序号字段，从1开始
-            "学生编号": str(student_id) if student_id else '',
-            "姓名": student_name if student_name else ''  # 如果没有姓名，保持为空
-        }
-
-        # 尝试获取学号（如果存在，与学生编号不同）
-        if '学号' in df.columns:
-            student_info["学号"] = str(row.get('学号', '')) if row.get('学号', '') else ''
-
-        # 尝试获取其他可能的学生信息字段
-        for col in ['班级', '性别', '年龄']:
-            if col in df.columns:
-                val = row.get(col, '')
-                student_info[col] = str(val) if val else ''
-
-        # 只检查班级薄弱项对应的维度
-        student_class_weaknesses = []
-        if student_key in student_weaknesses:
-            # 获取该学生的所有薄弱项
-            all_weaknesses = student_weaknesses[student_key]
+    class_weakness_set = set(class_weaknesses)
+
+    # 先为所有学生算出分组key（如"力量"、"力量+速度"），在班级薄弱项上没有问题的学生为空串
+    student_keys = _student_keys(df)
+    # 薄弱维度组合相同的学生分组key相同，按组合缓存，不必每个学生都筛选和排序
+    combo_group_keys: Dict[Tuple[str, ...], str] = {}
+    group_keys = []
+    for student_key, _, _ in student_keys:
+        weaknesses = tuple(student_weaknesses.get(student_key, ()))
+        group_key = combo_group_keys.get(weaknesses)
+        if group_key is None:
             # 只保留属于班级薄弱项的部分
-            student_class_weaknesses = [w for w in all_weaknesses if w in class_weaknesses]
+            group_key = combo_group_keys[weaknesses] = "+".join(sorted(w for w in weaknesses if w in class_weakness_set))
+        group_keys.append(group_key)
+
+    # sort=False：分组按首次出现的顺序排列，组内学生保持表格中的行顺序
+    group_key_series = pd.Series(group_keys, dtype=object)
+    group_positions = group_key_series.groupby(group_key_series, sort=False).indices
+    group_positions.pop("", None)
+    if not group_positions:
+        return {}
 
-        # 如果该学生在班级薄弱项上没有问题，跳过
-        if not student_class_weaknesses:
-            continue
+    # 学生详细信息只需要这几列，整列取出后按行号查
+    info_columns = [col for col in ['学号', '班级', '性别', '年龄'] if col in df.columns]
+    info_values = df[info_columns].to_numpy(dtype=object) if info_columns else None
+    row_numbers = df.index.tolist()
 
-        # 生成分组key（如"力量"、"力量+速度"）
-        group_key = "+".join(sorted(student_class_weaknesses))
+    # 数据中存在的等级列，用于筛选各分组对应的体测项目
+    present_columns = set(df.columns)
 
-        if group_key not in groups:
-            groups[group_key] = {
-                "count": 0,
-                "students": [],
-                "student_details": [],  # 新增：学生详细信息列表
-                "weakness_items": []
+    groups = {}
+    for group_key in dict.fromkeys(key for key in group_keys if key):
+        positions = group_positions[group_key]
+        students = []
+        student_details = []
+        for pos in positions:
+            student_key, student_id, student_name = student_keys[pos]
+            # 获取学生的详细信息
+            student_info = {
+                "序号": row_numbers[pos] + 1,  # 添加序号字段，从1开始
+                "学生编号": str(student_id) if student_id else '',
+                "姓名": student_name if student_name else ''  # 如果没有姓名，保持为空
             }
+            # 学号（如果存在，与学生编号不同）及其他可能的学生信息字段
+            for col, val in zip(info_columns, info_values[pos] if info_values is not None else ()):
+                student_info[col] = str(val) if val else ''
+            students.append(student_key)
+            student_details.append(student_info)
 
-        groups[group_key]["count"] += 1
-        groups[group_key]["students"].append(student_key)
-        groups[group_key]["student_details"].append(student_info)
-
-    # 为每个分组找出对应的体测项目（使用全局WEAKNESS_MAPPING）
-    for group_key, group_info in groups.items():
         weakness_dims = group_key.split("+")
-        items = []
-        for item, dimension in WEAKNESS_MAPPING.items():
-            if dimension in weakness_dims:
-                grade_col = f"{item}等级"
-                if grade_col in df.columns:
-                    items.append(item)
-        # 去重
-        group_info["weakness_items"] = list(set(items))
+        groups[group_key] = {
+            "count": len(positions),
+            "students": students,
+            "student_details": student_details,  # 新增：学生详细信息列表
+            "weakness_items": [item for dim in weakness_dims for item in DIM_TO_ITEMS.get(dim, ())
+                               if GRADE_COLUMNS[item] in present_columns]
+        }
 
     # 按人数降序排序
     sorted_groups = dict(sorted(groups.items(), key=lambda x: x[1]["count"], reverse=True))
@@ -270,87 +391,93 @@ def group_students_by_weakness(student_weaknesses: Dict[str, List[str]], df: pd.
     return sorted_groups
 
 
-def analyze_class_weakness(df: pd.DataFrame, class_name: str) -> Tuple[List[str], Dict[str, str], Dict[str, str]]:
+def _score_items(counts: np.ndarray, totals: np.ndarray, is_weight: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    薄弱分数计算内核（纯NumPy数组运算）
+
+    参数:
+        counts: (项目数, 4) 各等级人数，列顺序：标准项目为 优秀/良好/及格/不及格，体重为 正常/超重/肥胖/低体重
+        totals: (项目数,) 各项目有效记录数
+        is_weight: (项目数,) 是否为体重项目
+
+    返回:
+        (各等级占比%, 薄弱分数)，分数越高表示越薄弱
+    """
+    import numpy as np
+
+    rates = counts / totals[:, None] * 100
+
+    # 标准项目：优秀率越低、及格率越高越薄弱；体重：正常率越低越薄弱，肥胖加权更高
+    standard_scores = (100 - rates[:, 0]) + rates[:, 2] + rates[:, 3] * 2
+    weight_scores = (100 - rates[:, 0]) + rates[:, 2] * 2 + rates[:, 1] * 1.5 + rates[:, 3] * 1.5
+    return rates, np.where(is_weight, weight_scores, standard_scores)
+
+
+def analyze_class_weakness(df: pd.DataFrame, class_name: str, grade_stats: Optional[Dict[str, Dict]] = None) -> Tuple[List[str], Dict[str, str], Dict[str, str]]:
     """
     分析班级的薄弱项
 
+    grade_stats为compute_grade_stats(df)的结果，已计算过时传入以免重复统计
+
     返回: (薄弱项列表, 薄弱项详细信息字典, 薄弱项对应的体测项目字典)
     """
+    import numpy as np
+
     weaknesses = []
     weakness_details = {}
     weakness_items = {}  # 记录每个薄弱维度对应的体测项目
 
-    weakness_scores = {}
-
-    # 分析各项体测数据的等级分布（使用全局WEAKNESS_MAPPING）
-    for item, dimension in WEAKNESS_MAPPING.items():
-        grade_col = f"{item}等级"
-        if grade_col not in df.columns:
-            continue
-
-        # 统计等级分布
-        grade_counts = df[grade_col].value_counts()
-        total = len(df[df[grade_col].notna()])
+    # 一次性统计所有项目的等级分布（使用全局WEAKNESS_MAPPING）
+    if grade_stats is None:
+        grade_stats = compute_grade_stats(df)
+    all_grade_counts, all_totals = grade_stats["counts"], grade_stats["totals"]
 
-        if total == 0:
-            continue
+    # 只保留有有效数据的项目；体重等级使用特殊的分类系统（正常、超重、肥胖、低体重）
+    # 注意：等级全相同的项目不能跳过，例如全班"不及格"恰恰是最薄弱的项目，必须参与评分
+    items = [item for item, total in all_totals.items() if total > 0]
+    if not items:
+        return weaknesses, weakness_details, weakness_items
 
-        # 体重等级使用特殊的分类系统
-        if item == "体重":
-            # 体重等级：正常、超重、肥胖、低体重
-            normal_count = grade_counts.get("正常", 0)
-            overweight_count = grade_counts.get("超重", 0)
-            obese_count = grade_counts.get("肥胖", 0)
-            underweight_count = grade_counts.get("低体重", 0)
+    is_weight = np.array([item == "体重" for item in items])
+    counts = np.array([all_grade_counts[item] for item in items], dtype=np.int64)
+    totals = np.array([all_totals[item] for item in items], dtype=np.int64)
 
-            normal_rate = normal_count / total * 100
-            overweight_rate = overweight_count / total * 100
-            obese_rate = obese_count / total * 100
-            underweight_rate = underweight_count / total * 100
+    rates, scores = _score_items(counts, totals, is_weight)
 
-            # 计算薄弱分数（正常率越低，分数越高表示越薄弱）
-            weakness_score = (100 - normal_rate) + obese_rate * 2 + overweight_rate * 1.5 + underweight_rate * 1.5
+    # 修复：对于同一维度的多个项目，选择最薄弱的那个（分数相同时保留先出现的项目）
+    best_index: Dict[str, int] = {}
+    for i, item in enumerate(items):
+        dimension = WEAKNESS_MAPPING[item]
+        if dimension not in best_index or scores[i] > scores[best_index[dimension]]:
+            best_index[dimension] = i
 
+    weakness_scores = {}
+    for dimension, i in best_index.items():
+        if is_weight[i]:
             # 为了统一接口，将体重等级映射到标准等级
-            excellent_count = normal_count
-            good_count = 0
-            pass_count = overweight_count + underweight_count
-            fail_count = obese_count
-
-            excellent_rate = normal_rate
-            good_rate = 0
-            pass_rate = overweight_rate + underweight_rate
-            fail_rate = obese_rate
+            normal_count, overweight_count, obese_count, underweight_count = counts[i]
+            normal_rate, overweight_rate, obese_rate, underweight_rate = rates[i]
+            excellent_count, good_count = normal_count, 0
+            pass_count, fail_count = overweight_count + underweight_count, obese_count
+            excellent_rate, good_rate = normal_rate, 0
+            pass_rate, fail_rate = overweight_rate + underweight_rate, obese_rate
         else:
-            # 其他项目使用标准分类：优秀、良好、及格、不及格
-            excellent_count = grade_counts.get("优秀", 0)
-            good_count = grade_counts.get("良好", 0)
-            pass_count = grade_counts.get("及格", 0)
-            fail_count = grade_counts.get("不及格", 0)
-
-            excellent_rate = excellent_count / total * 100
-            good_rate = good_count / total * 100
-            pass_rate = pass_count / total * 100
-            fail_rate = fail_count / total * 100
-
-            # 计算薄弱分数（优秀率越低、及格率越高，分数越高表示越薄弱）
-            weakness_score = (100 - excellent_rate) + pass_rate + fail_rate * 2
-
-        # 修复：对于同一维度的多个项目，选择最薄弱的那个
-        if dimension not in weakness_scores or weakness_score > weakness_scores[dimension]["score"]:
-            weakness_scores[dimension] = {
-                "score": weakness_score,
-                "item": item,
-                "excellent_rate": excellent_rate,
-                "good_rate": good_rate,
-                "pass_rate": pass_rate,
-                "fail_rate": fail_rate,
-                "excellent_count": excellent_count,
-                "good_count": good_count,
-                "pass_count": pass_count,
-                "fail_count": fail_count,
-                "total": total
-            }
+            excellent_count, good_count, pass_count, fail_count = counts[i]
+            excellent_rate, good_rate, pass_rate, fail_rate = rates[i]
+
+        weakness_scores[dimension] = {
+            "score": scores[i],
+            "item": items[i],
+            "excellent_rate": excellent_rate,
+            "good_rate": good_rate,
+            "pass_rate": pass_rate,
+            "fail_rate": fail_rate,
+            "excellent_count": excellent_count,
+            "good_count": good_count,
+            "pass_count": pass_count,
+            "fail_count": fail_count,
+            "total": totals[i]
+        }
 
     # 找出最薄弱的2个维度
     sorted_weaknesses = sorted(weakness_scores.items(), key=lambda x: x[1]["score"], reverse=True)
@@ -359,42 +486,87 @@ def analyze_class_weakness(df: pd.DataFrame, class_name: str) -> Tuple[List[str]
         weaknesses.append(dimension)
         weakness_items[dimension] = stats['item']  # 记录对应的体测项目
 
-        # 生成详细描述
-        detail = f"从体测数据来看，{dimension}是{class_name}的薄弱项：{stats['item']}"
+        # 生成详细描述（各分句收集后一次性拼接）
+        parts = [f"从体测数据来看，{dimension}是{class_name}的薄弱项：{stats['item']}"]
 
         if stats['excellent_count'] == 0:
-            detail += f"无'优秀'等级学生，"
+            parts.append("无'优秀'等级学生，")
         else:
-            detail += f"仅{stats['excellent_count']}人（占比{stats['excellent_rate']:.1f}%）达到'优秀'，"
+            parts.append(f"仅{stats['excellent_count']}人（占比{stats['excellent_rate']:.1f}%）达到'优秀'，")
 
         if stats['good_count'] > 0:
-            detail += f"{stats['good_count']}人（占比{stats['good_rate']:.1f}%）达到'良好'，"
+            parts.append(f"{stats['good_count']}人（占比{stats['good_rate']:.1f}%）达到'良好'，")
 
-        detail += f"{stats['pass_count']}人（占比{stats['pass_rate']:.1f}%）为'及格'"
+        parts.append(f"{stats['pass_count']}人（占比{stats['pass_rate']:.1f}%）为'及格'")
 
         if stats['fail_count'] > 0:
-            detail += f"，{stats['fail_count']}人（占比{stats['fail_rate']:.1f}%）为'不及格'"
+            parts.append(f"，{stats['fail_count']}人（占比{stats['fail_rate']:.1f}%）为'不及格'")
 
-        detail += f"，{dimension}素质提升需求迫切。"
+        parts.append(f"，{dimension}素质提升需求迫切。")
 
-        weakness_details[dimension] = detail
+        weakness_details[dimension] = "".join(parts)
 
     return weaknesses, weakness_details, weakness_items
 
 
+# 班级分析结果的磁盘缓存（按文件名、大小、修改时间和分析逻辑版本区分）
+# 修改分析逻辑（薄弱项评分、分组规则等）后需要递增CODE_VERSION，使旧缓存失效
+CODE_VERSION = 1
+CACHE_DIR = Path(__file__).parent / ".cache" / "class_profiles"
+
+
+def _cache_path(file_path: Path) -> Path:
+    """根据文件状态计算缓存文件路径"""
+    file_stat = file_path.stat()
+    key = f"{file_path.name}|{file_stat.st_size}|{file_stat.st_mtime_ns}|{CODE_VERSION}"
+    return CACHE_DIR / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+
+def _load_cached_analysis(file_path: Path):
+    """读取文件对应的分析缓存，返回 (班级名称, 班级配置)；没有缓存或缓存不可用时返回None"""
+    try:
+        with open(_cache_path(file_path), "rb") as f:
+            cached = json_loads(f.read())
+        return cached["class_name"], cached["profile"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
 def analyze_class_file(file_path: Path) -> Dict:
-    """分析单个班级文件"""
-    df = pd.read_excel(file_path)
+    """分析单个班级文件（文件未变化时直接使用缓存结果）"""
+    file_path = Path(file_path)
+    cached = _load_cached_analysis(file_path)
+    if cached is not None:
+        return cached
+
+    cache_file = _cache_path(file_path)
+    class_name, profile = _analyze_class_file(file_path)
+
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_bytes_atomic(cache_file, json_dumps_bytes({"class_name": class_name, "profile": profile}))
+    except OSError as e:
+        logger.warning(f"写入分析缓存失败: {cache_file}, 错误: {e}")
+
+    return class_name, profile
+
+
+def _analyze_class_file(file_path: Path) -> Dict:
+    """分析单个班级文件（不使用缓存）"""
+    df = read_class_excel(file_path)
     class_name = file_path.stem  # 例如：一年级1班
 
     # 从班级名称中提取年级（而不是从Excel文档内部的"年级编号"列）
     grade_query = extract_grade_from_class_name(class_name)
 
+    # 统计各项目等级分布（班级分析和学生分析共用）
+    grade_stats = compute_grade_stats(df)
+
     # 分析班级整体薄弱项
-    weaknesses, weakness_details, weakness_test_items = analyze_class_weakness(df, class_name)
+    weaknesses, weakness_details, weakness_test_items = analyze_class_weakness(df, class_name, grade_stats)
 
     # 分析学生个体薄弱项
-    student_weaknesses = analyze_student_weaknesses(df)
+    student_weaknesses = analyze_student_weaknesses(df, grade_stats)
 
     # 按班级薄弱项分组（只针对班级的2-3个薄弱项）
     student_groups = group_students_by_weakness(student_weaknesses, df, class_weaknesses=weaknesses)
@@ -424,6 +596,77 @@ def analyze_class_file(file_path: Path) -> Dict:
     return class_name, profile
 
 
+def list_class_files(class_data_dir) -> List[Path]:
+    """列出班级数据目录下的所有.xlsx文件（按文件名排序），目录不存在时返回空列表"""
+    try:
+        with os.scandir(class_data_dir) as entries:
+            names = sorted(
+                entry.name for entry in entries
+                if entry.name.endswith(".xlsx") and entry.is_file()
+            )
+    except FileNotFoundError:
+        return []
+    return [Path(class_data_dir) / name for name in names]
+
+
+def _analyze_class_file_safe(file_path: Path):
+    """
+    进程池worker：分析单个班级文件，异常作为返回值带回（避免一个文件出错中断整批）
+
+    返回: (文件路径, (班级名称, 班级配置) 或 None, 错误信息 或 None)
+    """
+    try:
+        return file_path, analyze_class_file(file_path), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def analyze_class_files(class_files: List[Path], use_processes: bool = True) -> List[Tuple]:
+    """
+    批量分析班级文件：先在主进程读取分析缓存，未命中的文件交给进程池（或线程池）并行分析
+
+    各班级文件相互独立，Excel解析是CPU密集型，使用多进程绕开GIL；全部命中缓存时不启动进程池。
+    进程池使用spawn方式启动，worker中的日志直接写入文件（log_utils.use_direct_log_handlers），不经过主进程的日志队列。
+    spawn的worker会重新导入主进程的__main__：在Web服务进程（python app.py）中每个worker都要先导入Flask、openai等
+    （约1.3秒），比分析一批文件本身（约30毫秒/个）还慢，因此Web接口传入use_processes=False改用线程池。
+
+    参数:
+        class_files: 班级文件路径列表
+        use_processes: True使用spawn进程池（命令行批量生成），False使用线程池（Web服务进程内调用）
+
+    返回: 与class_files顺序一致的 [(文件路径, (班级名称, 班级配置) 或 None, 错误信息 或 None)]
+    """
+    results = [(file_path, _load_cached_analysis(file_path), None) for file_path in class_files]
+    pending = [idx for idx, (_, result, _) in enumerate(results) if result is None]
+    if len(pending) < len(class_files):
+        logger.info(f"{len(class_files) - len(pending)} 个班级文件未变化，使用缓存的分析结果")
+
+    pending_files = [class_files[idx] for idx in pending]
+    max_workers = min(len(pending_files), os.cpu_count() or 1)
+    if max_workers > 1 and not use_processes:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analyze") as executor:
+            analyzed = list(executor.map(_analyze_class_file_safe, pending_files))
+    elif max_workers > 1:
+        # concurrent.futures.process会连带导入multiprocessing，只在批量分析时才需要
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        from log_utils import use_direct_log_handlers
+
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=use_direct_log_handlers,
+        ) as executor:
+            analyzed = list(executor.map(_analyze_class_file_safe, pending_files, chunksize=4))
+    else:
+        analyzed = [_analyze_class_file_safe(file_path) for file_path in pending_files]
+    for idx, item in zip(pending, analyzed):
+        results[idx] = item
+    return results
+
+
 def generate_class_profiles(class_data_dir="class_data", output_file="prompts/class_profiles.json", max_classes=10):
     """
     生成class_profiles.json文件
@@ -436,33 +679,104 @@ def generate_class_profiles(class_data_dir="class_data", output_file="prompts/cl
     class_data_path = Path(class_data_dir)
     profiles = {}
     
-    # 获取所有班级文件
-    class_files = sorted(class_data_path.glob("*.xlsx"))
+    # 获取所有班级文件（scandir直接返回目录项类型信息，不必为每个文件额外stat）
+    class_files = list_class_files(class_data_path)
     
     if max_classes:
         class_files = class_files[:max_classes]
     
     logger.info(f"开始分析 {len(class_files)} 个班级...")
-    
-    for idx, file_path in enumerate(class_files, 1):
-        try:
-            class_name, profile = analyze_class_file(file_path)
+
+    results = analyze_class_files(class_files)
+
+    for idx, (file_path, result, error) in enumerate(results, 1):
+        if error is None:
+            class_name, profile = result
             profiles[class_name] = profile
             logger.info(f"[{idx}/{len(class_files)}] 分析完成: {class_name}")
-        except Exception as e:
-            logger.error(f"[{idx}/{len(class_files)}] 分析失败: {file_path.name}, 错误: {e}")
+        else:
+            logger.error(f"[{idx}/{len(class_files)}] 分析失败: {file_path.name}, 错误: {error}")
     
     # 保存到JSON文件
     output_path = Path(output_file)
     output_path.parent.mkdir(exist_ok=True)
     
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(profiles, f, ensure_ascii=False, indent=2)
+    _write_bytes_atomic(output_path, json_dumps_bytes(profiles, indent=True))
     
     logger.info(f"\n生成完成！共分析 {len(profiles)} 个班级，保存到 {output_file}")
     return profiles
 
 
+LLM_CACHE_DIR = Path(__file__).parent / ".cache" / "llm"
+# AI分析结果缓存最多保留的文件数，超出后按修改时间删除最久未使用的（设为0不限制）
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500"))
+
+
+def _load_llm_cache(cache_file: Path) -> Optional[str]:
+    """读取缓存的AI分析结果，不存在或损坏时返回None；命中时更新文件修改时间，清理时视为最近使用"""
+    try:
+        with open(cache_file, "rb") as f:
+            response_text = json_loads(f.read())["response_text"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+    return response_text
+
+
+def _prune_llm_cache(cache_dir: Path, max_entries: int):
+    """缓存文件数超过max_entries时，按修改时间从旧到新删除多出的文件"""
+    if max_entries <= 0:
+        return
+    entries = []
+    for cache_file in cache_dir.glob("*.json"):
+        try:
+            entries.append((cache_file.stat().st_mtime, cache_file))
+        except OSError:  # 其他进程已删除
+            continue
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, cache_file in entries[:len(entries) - max_entries]:
+        try:
+            cache_file.unlink()
+        except OSError:
+            continue
+
+
+def _save_llm_cache(cache_file: Path, response_text: str):
+    """保存AI分析结果到缓存（仅缓存能解析出JSON的结果），并清理超出数量上限的旧缓存"""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        _write_bytes_atomic(cache_file, json_dumps_bytes({"response_text": response_text}))
+    except OSError as e:
+        logger.warning(f"写入AI分析缓存失败: {cache_file}, 错误: {e}")
+        return
+    _prune_llm_cache(cache_file.parent, LLM_CACHE_MAX_ENTRIES)
+
+
+# 班级体测分析的系统提示词（静态内容，不拼接班级数据）
+CLASS_ANALYSIS_SYSTEM_PROMPT = """你是一位专业的体育教师，擅长分析学生体测数据。请根据用户提供的班级体测数据统计识别薄弱项。
+
+**重要规则：**
+1. 薄弱项只能从以下6个维度中选择：形态、耐力、力量、柔韧、速度、机能
+2. 请选择最薄弱的1-2个维度
+3. 对每个薄弱维度，给出详细的分析说明
+
+请以JSON格式返回分析结果：
+```json
+{
+    "weaknesses": ["维度1", "维度2"],
+    "weakness_details": {
+        "维度1": "详细分析说明...",
+        "维度2": "详细分析说明..."
+    }
+}
+```"""
+
+
 def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None, Dict]:
     """
     使用大模型分析体测数据（流式输出）
@@ -472,9 +786,10 @@ def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None,
         class_name: 班级名称
 
     返回:
-        生成器，yield分析过程，最后返回分析结果
+        生成器，yield分析过程文本；AI生成过程中yield ("__AI_TOKEN__", 文本片段)，
+        最后yield ("__PROFILE__", 分析结果)
     """
-    from ai_model_optimized import OptimizedAIModel
+    from ai_model_optimized import get_ai_model, extract_json_object, iter_stream_text
 
     try:
         # 从班级名称中提取年级（而不是从Excel文档内部的"年级编号"列）
@@ -489,77 +804,73 @@ def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None,
 
         # 使用全局WEAKNESS_MAPPING统计所有项目
         stats_text = ""
-        for item, dimension in WEAKNESS_MAPPING.items():
-            grade_col = f"{item}等级"
-            if grade_col in df.columns:
-                grade_counts = df[grade_col].value_counts()
-                total = len(df[df[grade_col].notna()])
-                if total > 0:
-                    # 体重等级使用特殊的分类系统
-                    if item == "体重":
-                        stats_text += f"- {item}（{dimension}）：正常{grade_counts.get('正常', 0)}人，超重{grade_counts.get('超重', 0)}人，肥胖{grade_counts.get('肥胖', 0)}人，低体重{grade_counts.get('低体重', 0)}人\n"
-                    else:
-                        stats_text += f"- {item}（{dimension}）：优秀{grade_counts.get('优秀', 0)}人，良好{grade_counts.get('良好', 0)}人，及格{grade_counts.get('及格', 0)}人，不及格{grade_counts.get('不及格', 0)}人\n"
+        grade_stats = compute_grade_stats(df)
+        all_grade_counts, all_totals = grade_stats["counts"], grade_stats["totals"]
+        for item, total in all_totals.items():
+            if total > 0:
+                # 体重等级使用特殊的分类系统（grade_levels返回对应的等级顺序）
+                level_text = "，".join(f"{level}{n}人" for level, n in zip(grade_levels(item), all_grade_counts[item]))
+                stats_text += f"- {item}（{WEAKNESS_MAPPING[item]}）：{level_text}\n"
 
         yield stats_text + "\n"
 
         # 调用大模型分析
         yield "🤖 正在使用AI分析薄弱项...\n\n"
 
-        model = OptimizedAIModel()
+        model = get_ai_model()
 
-        prompt = f"""你是一位专业的体育教师，请分析以下班级的体测数据，识别薄弱项。
+        # 固定的规则和输出格式放在system消息里，每次请求前缀完全一致，便于服务端前缀缓存命中
+        prompt = f"""请分析以下班级的体测数据，识别薄弱项。
 
 班级：{class_name}
 年级：{grade_query}年级
 学生人数：{len(df)}人
 
 各项体测数据统计：
-{stats_text}
-
-**重要规则：**
-1. 薄弱项只能从以下6个维度中选择：形态、耐力、力量、柔韧、速度、机能
-2. 请选择最薄弱的1-2个维度
-3. 对每个薄弱维度，给出详细的分析说明
-
-请以JSON格式返回分析结果：
-```json
-{{
-    "weaknesses": ["维度1", "维度2"],
-    "weakness_details": {{
-        "维度1": "详细分析说明...",
-        "维度2": "详细分析说明..."
-    }}
-}}
-```"""
+{stats_text}"""
 
         messages = [
-            {"role": "system", "content": "你是一位专业的体育教师，擅长分析学生体测数据。"},
+            {"role": "system", "content": CLASS_ANALYSIS_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
 
+        # 相同模型、相同提示词（即统计数据未变化）时直接复用之前的AI分析结果
+        llm_cache_file = LLM_CACHE_DIR / f"{hashlib.sha1(json_dumps_bytes([model.model, messages])).hexdigest()}.json"
+        response_text = _load_llm_cache(llm_cache_file)
+
         try:
-            response = model.client.chat.completions.create(
-                model=model.model,
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.3
-            )
-            response_text = response.choices[0].message.content.strip()
+            if response_text is None:
+                # 流式调用：边生成边把片段以("__AI_TOKEN__", 文本)的形式推给调用方，首字即可见
+                stream = model.client.chat.completions.create(
+                    model=model.model,
+                    messages=messages,
+                    max_tokens=1000,
+                    temperature=0.3,
+                    stream=True,
+                )
+                response_parts = []
+                for text in iter_stream_text(stream):
+                    response_parts.append(text)
+                    yield ("__AI_TOKEN__", text)
+                response_text = "".join(response_parts).strip()
+                if extract_json_object(response_text) is not None:
+                    _save_llm_cache(llm_cache_file, response_text)
+            else:
+                logger.info(f"使用缓存的AI分析结果: {class_name}")
             yield f"AI分析结果：\n{response_text}\n\n"
         except Exception as api_error:
             # 记录详细的API错误信息
             logger.error(f"AI模型API调用失败: {api_error}")
             yield f"⚠️ AI分析失败（{str(api_error)}），使用传统方法分析...\n\n"
             # 使用传统方法分析
-            weaknesses, weakness_details, _ = analyze_class_weakness(df, class_name)
+            weaknesses, weakness_details, _ = analyze_class_weakness(df, class_name, grade_stats)
             weaknesses = [w for w in weaknesses if w in ALLOWED_WEAKNESSES][:2]
 
             yield f"✅ 识别到薄弱项：{', '.join(weaknesses)}\n\n"
 
             # 分析学生个体薄弱项和分组
             yield "👥 正在分析学生个体薄弱项...\n"
-            student_weaknesses = analyze_student_weaknesses(df)
+            student_weaknesses = analyze_student_weaknesses(df, grade_stats)
             yield f"✅ 已分析 {len(student_weaknesses)} 名学生的薄弱项\n\n"
 
             yield f"📊 正在按班级薄弱项（{', '.join(weaknesses)}）对学生分组...\n"
@@ -584,16 +895,14 @@ def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None,
             return
 
         # 解析JSON结果
-        import re
-        json_match = re.search(r'```json\s*(\{.*?\})\s*```', response_text, re.DOTALL)
-        if json_match:
-            analysis_result = json.loads(json_match.group(1))
+        analysis_result = extract_json_object(response_text)
+        if analysis_result is not None:
             weaknesses = analysis_result.get('weaknesses', [])
             weakness_details = analysis_result.get('weakness_details', {})
         else:
             # 如果没有找到JSON，使用传统方法分析
             yield "⚠️ AI返回格式异常，使用传统方法分析...\n\n"
-            weaknesses, weakness_details, _ = analyze_class_weakness(df, class_name)
+            weaknesses, weakness_details, _ = analyze_class_weakness(df, class_name, grade_stats)
 
         # 确保薄弱项在允许的范围内
         weaknesses = [w for w in weaknesses if w in ALLOWED_WEAKNESSES][:2]
@@ -602,7 +911,7 @@ def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None,
 
         # 分析学生个体薄弱项和分组
         yield "👥 正在分析学生个体薄弱项...\n"
-        student_weaknesses = analyze_student_weaknesses(df)
+        student_weaknesses = analyze_student_weaknesses(df, grade_stats)
         yield f"✅ 已分析 {len(student_weaknesses)} 名学生的薄弱项\n\n"
 
         yield f"📊 正在按班级薄弱项（{', '.join(weaknesses)}）对学生分组...\n"
@@ -633,12 +942,12 @@ def analyze_with_llm(df: pd.DataFrame, class_name: str) -> Generator[str, None,
         raise e
 
 
-def analyze_uploaded_file(file_content: bytes, class_name: str, output_file: str = "prompts/class_profiles.json") -> Dict:
+def analyze_uploaded_file(file_content, class_name: str, output_file: str = "prompts/class_profiles.json") -> Dict:
     """
     分析上传的体测数据文件
 
     参数:
-        file_content: 文件内容（字节）
+        file_content: 文件内容（字节），或可seek的文件对象（如上传请求的文件流）
         class_name: 班级名称
         output_file: 输出JSON文件路径
 
@@ -647,16 +956,21 @@ def analyze_uploaded_file(file_content: bytes, class_name: str, output_file: str
     """
     try:
         # 读取Excel文件
-        df = pd.read_excel(io.BytesIO(file_content))
+        if isinstance(file_content, (bytes, bytearray)):
+            file_content = io.BytesIO(file_content)
+        df = read_class_excel(file_content)
 
         # 从班级名称中提取年级（而不是从Excel文档内部的"年级编号"列）
         grade_query = extract_grade_from_class_name(class_name)
 
+        # 统计各项目等级分布（班级分析和学生分析共用）
+        grade_stats = compute_grade_stats(df)
+
         # 分析班级整体薄弱项
-        weaknesses, weakness_details, weakness_test_items = analyze_class_weakness(df, class_name)
+        weaknesses, weakness_details, weakness_test_items = analyze_class_weakness(df, class_name, grade_stats)
 
         # 分析学生个体薄弱项
-        student_weaknesses = analyze_student_weaknesses(df)
+        student_weaknesses = analyze_student_weaknesses(df, grade_stats)
 
         # 按班级薄弱项分组（只针对班级的2-3个薄弱项）
         student_groups = group_students_by_weakness(student_weaknesses, df, class_weaknesses=weaknesses)
@@ -697,6 +1011,30 @@ def analyze_uploaded_file(file_content: bytes, class_name: str, output_file: str
         }
 
 
+# 同一进程内多个请求线程修改配置文件时的互斥锁
+_PROFILES_WRITE_LOCK = threading.Lock()
+
+
+@contextmanager
+def _profiles_write_lock(output_path: Path):
+    """
+    配置文件"读取-修改-写回"期间的互斥锁
+
+    进程内用线程锁，进程间（多个worker）用同目录下".lock"文件的fcntl.flock。
+    不直接锁配置文件本身：原子写会用os.replace替换文件，锁在旧inode上就失效了。
+    """
+    with _PROFILES_WRITE_LOCK:
+        if fcntl is None:
+            yield
+            return
+        with open(output_path.with_name(output_path.name + ".lock"), "a+b") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def update_class_profile(class_name: str, profile: Dict, output_file: str = "prompts/class_profiles.json"):
     """
     更新class_profiles.json文件
@@ -709,27 +1047,21 @@ def update_class_profile(class_name: str, profile: Dict, output_file: str = "pro
     output_path = Path(output_file)
     output_path.parent.mkdir(exist_ok=True)
 
-    # 读取现有配置
-    if output_path.exists():
-        try:
-            with open(output_path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if content:
-                    profiles = json.loads(content)
-                else:
-                    profiles = {}
-        except (json.JSONDecodeError, ValueError):
-            # 如果JSON文件损坏或为空，初始化为空字典
-            profiles = {}
-    else:
-        profiles = {}
+    # 并发上传时逐个读取-修改-写回，避免后写入的覆盖掉先写入的班级
+    with _profiles_write_lock(output_path):
+        # 读取现有配置（文件未变化时复用已解析的结果；JSON文件损坏或为空时为空字典）
+        profiles = get_all_class_profiles(output_file)
 
-    # 更新配置
-    profiles[class_name] = profile
+        # 配置未变化（如重复上传同一文件）时不重写整个文件
+        if profiles.get(class_name) == profile:
+            return
 
-    # 保存到JSON文件
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(profiles, f, ensure_ascii=False, indent=2)
+        # 更新配置（复制一层，不修改缓存中共享的字典）
+        profiles = dict(profiles)
+        profiles[class_name] = profile
+
+        # 保存到JSON文件
+        _save_class_profiles(output_path, profiles)
 
 
 def delete_class_profile(class_name: str, output_file: str = "prompts/class_profiles.json") -> bool:
@@ -748,54 +1080,68 @@ def delete_class_profile(class_name: str, output_file: str = "prompts/class_prof
     if not output_path.exists():
         return False
 
-    try:
-        with open(output_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                profiles = json.loads(content)
-            else:
-                profiles = {}
-    except (json.JSONDecodeError, ValueError):
-        # 如果JSON文件损坏或为空，返回False
-        return False
+    with _profiles_write_lock(output_path):
+        # 如果JSON文件损坏或为空，读到的是空字典，返回False
+        profiles = get_all_class_profiles(output_file)
 
-    if class_name in profiles:
-        del profiles[class_name]
+        if class_name in profiles:
+            profiles = {name: value for name, value in profiles.items() if name != class_name}
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(profiles, f, ensure_ascii=False, indent=2)
+            _save_class_profiles(output_path, profiles)
 
-        return True
+            return True
 
     return False
 
 
+# get_all_class_profiles的内存缓存：{文件绝对路径: ((inode, mtime_ns, size), 配置字典)}
+_PROFILES_CACHE: Dict[str, Tuple[Tuple[int, int, int], Dict]] = {}
+
+
+def _save_class_profiles(output_path: Path, profiles: Dict):
+    """写回配置文件，并用刚写入的内容更新get_all_class_profiles的缓存，下次读取无需重新解析"""
+    _write_bytes_atomic(output_path, json_dumps_bytes(profiles, indent=True))
+    cache_key = os.path.abspath(output_path)
+    file_stat = os.stat(cache_key)
+    _PROFILES_CACHE[cache_key] = ((file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size), profiles)
+
+
 def get_all_class_profiles(output_file: str = "prompts/class_profiles.json") -> Dict:
     """
     获取所有班级配置
 
+    文件未变化（inode、修改时间、大小都相同）时直接返回内存中已解析的结果，只需一次stat。
+    返回的字典在多次调用间共享，调用方不要修改。
+
     参数:
         output_file: JSON文件路径
 
     返回:
         所有班级配置字典
     """
-    output_path = Path(output_file)
-
-    if not output_path.exists():
+    cache_key = os.path.abspath(output_file)
+    try:
+        file_stat = os.stat(cache_key)
+    except OSError:
+        _PROFILES_CACHE.pop(cache_key, None)
         return {}
 
+    signature = (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _PROFILES_CACHE.get(cache_key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
     try:
-        with open(output_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                return json.loads(content)
-            else:
-                return {}
-    except (json.JSONDecodeError, ValueError):
+        with open(cache_key, "rb") as f:
+            content = f.read()
+        profiles = json_loads(content) if content.strip() else {}
+    except (OSError, ValueError):
         # 如果JSON文件损坏或为空，返回空字典
         return {}
 
+    _PROFILES_CACHE[cache_key] = (signature, profiles)
+    return profiles
+
 
 if __name__ == "__main__":
     # 测试：分析class_data文件夹中的所有班级
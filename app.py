@@ -4,84 +4,78 @@
 教师端AI备课助手Web应用（整合版本）
 """
 
-from flask import Flask, render_template, request, jsonify, Response, send_file
+from flask import Flask, render_template, request, jsonify, Response, send_file, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 import json
 import argparse
+import hashlib
+import re
+import time
+import uuid
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import List
+import threading
+import zlib
+from copy import deepcopy
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
-import pandas as pd
+from log_utils import setup_queue_logger
+from json_utils import json_dumps_bytes
 from io import BytesIO
 from docx import Document
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
+from docx.table import _Cell
 
 # 加载环境变量
 load_dotenv()
 
+# 调试开关：启动时读取一次，请求处理中不再反复查询环境变量
+DEBUG_AI = os.getenv('DEBUG_AI', '1') == '1'
+# 是否在日志中完整输出检索结果（结果较大，需在DEBUG_AI基础上单独开启）
+DEBUG_SEARCH_DUMP = DEBUG_AI and os.getenv('DEBUG_SEARCH_DUMP', '0') == '1'
+
 # 配置日志
 def setup_app_logger():
     """配置应用日志系统"""
-    log_dir = Path(__file__).parent / "logs"
-    log_dir.mkdir(exist_ok=True)
-
-    logger = logging.getLogger("app")
-    logger.setLevel(logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
-
-    if logger.handlers:
-        return logger
-
-    log_file = log_dir / "app.log"
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
-    return logger
+    return setup_queue_logger("app", "app.log", logging.DEBUG if DEBUG_AI else logging.INFO)
 
 logger = setup_app_logger()
 
 # 导入教师端备课模块
 from teacher_planner import (
-    collect_entities_llm,
+    extract_entities_llm,
+    compute_missing_fields,
+    format_history,
     detect_intent_llm,
     call_lesson_plan_search,
     call_sports_meeting_search,
+    build_plan_messages,
     generate_plan,
     generate_plan_stream,
     load_class_profiles,
     TEACHER_SYSTEM_PROMPT,
+    HISTORY_MAX_TURNS,
 )
 
 # 导入AI模型
-from ai_model_optimized import OptimizedAIModel
+from ai_model_optimized import LazyJson, get_ai_model, iter_stream_text
 
 # 导入班级数据分析模块
 from analyze_class_data import (
     analyze_class_file,
+    analyze_class_files,
     analyze_with_llm,
     analyze_uploaded_file,
+    read_class_excel,
     get_all_class_profiles,
     delete_class_profile,
     update_class_profile,
@@ -93,36 +87,118 @@ CORS(app)
 # 配置
 SEARCH_BASE_URL = os.getenv("SEARCH_BASE_URL", "http://127.0.0.1:8001")
 
+# 后台线程池：意图识别和实体抽取是两次互不依赖的大模型调用，实体抽取放到这里与意图识别同时进行
+_AI_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai")
+
+
+def sse_event(payload: dict) -> bytes:
+    """将事件字典编码为一条SSE消息（data: JSON\n\n），中文直接以UTF-8输出"""
+    return b"data: " + json_dumps_bytes(payload) + b"\n\n"
+
+
+SSE_DONE = b"data: [DONE]\n\n"
+
 
 def gather_user_text(user_text: str, conversation_history: List[dict]) -> str:
     """收集用户输入和对话历史中的所有用户文本"""
-    pieces: List[str] = []
-    for msg in conversation_history or []:
-        if msg.get("role") == "user":
-            content = (msg.get("content") or "").strip()
-            if content:
-                pieces.append(content)
-    if user_text:
-        pieces.append(user_text.strip())
-    return " ".join(pieces)
-
-
-def detect_plan_type(current_text: str, conversation_history: List[dict]) -> str:
+    history_text = " ".join(
+        content
+        for msg in conversation_history or []
+        if msg.get("role") == "user" and (content := (msg.get("content") or "").strip())
+    )
+    if not user_text:
+        return history_text
+    current = user_text.strip()
+    return f"{history_text} {current}" if history_text else current
+
+
+# 意图识别结果的进程内缓存：相同输入（当前消息+最近的对话历史）在有效期内直接复用，省去一次大模型调用
+# AI_CACHE_TTL为缓存有效期（秒），设为0关闭缓存
+INTENT_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+INTENT_CACHE_MAX_SIZE = 1024
+_INTENT_CACHE: "OrderedDict[tuple, Tuple[float, str]]" = OrderedDict()
+_INTENT_CACHE_LOCK = threading.Lock()
+
+
+def _intent_cache_key(current_text: str, conversation_history: List[dict]):
+    """
+    意图缓存的key：当前输入 + 最近HISTORY_MAX_TURNS条消息（覆盖detect_intent_llm实际使用的全部历史）
+    历史内容不可哈希（如非字符串content）时返回None，不使用缓存
+    """
+    recent = (conversation_history or [])[-HISTORY_MAX_TURNS:]
+    key = (current_text, tuple((msg.get("role", ""), msg.get("content", "")) for msg in recent))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+# 本地意图预判：纯打招呼/致谢，或当前输入明确提到唯一一种方案场景时，无需调用大模型
+# （与意图识别提示词的规则一致：当前输入中的场景关键词优先于对话历史）
+# 只用不会产生歧义的标记："训练方案"、"教案"等也可能出现在运动会场景中（如"运动会训练方案"），交给大模型判断
+_CHAT_RE = re.compile(r'^(你好|您好|hi|hello|hey|谢谢|谢谢你|多谢|再见|拜拜|在吗|在不在)[\s!！。.,，~？?]*$', re.I)
+_SPORTS_RE = re.compile(r'全员运动会|全校运动会|运动会方案')
+_LESSON_RE = re.compile(r'课课练')
+# 当前输入同时提到另一种场景的相关词时不在本地判断（两种场景使用同一规则）
+_SPORTS_HINT_RE = re.compile(r'运动会')
+_LESSON_HINT_RE = re.compile(r'课课练|备课|教学|教案|训练|练习')
+
+
+def _local_plan_type(current_text: str) -> Optional[str]:
+    """按关键词本地判断意图，无法确定（无关键词或同时命中两种场景）时返回None"""
+    text = current_text.strip()
+    if _CHAT_RE.match(text):
+        return "chat"
+    if _SPORTS_RE.search(text) and not _LESSON_HINT_RE.search(text):
+        return "sports_meeting"
+    if _LESSON_RE.search(text) and not _SPORTS_HINT_RE.search(text):
+        return "lesson_plan"
+    return None
+
+
+def detect_plan_type(current_text: str, conversation_history: List[dict], history_text: Optional[str] = None) -> str:
     """
     使用大模型进行意图识别，判断是全员运动会、课课练还是闲聊
+    关键词能明确判断的输入直接本地返回，不调用大模型
+    history_text: 可选，已用format_history格式化的对话历史
     返回: "sports_meeting" | "lesson_plan" | "chat"
     """
+    local_intent = _local_plan_type(current_text)
+    if local_intent is not None:
+        if DEBUG_AI:
+            logger.debug(f"[TEACHER] 意图识别命中关键词: {local_intent}")
+        return local_intent
+
+    cache_key = _intent_cache_key(current_text, conversation_history) if INTENT_CACHE_TTL > 0 else None
+    if cache_key is not None:
+        now = time.monotonic()
+        with _INTENT_CACHE_LOCK:
+            cached = _INTENT_CACHE.get(cache_key)
+            if cached is not None and cached[0] > now:
+                _INTENT_CACHE.move_to_end(cache_key)
+                if DEBUG_AI:
+                    logger.debug(f"[TEACHER] 意图识别命中缓存: {cached[1]}")
+                return cached[1]
+
     try:
-        intent = detect_intent_llm(current_text, conversation_history)
+        intent = detect_intent_llm(current_text, conversation_history, history_text=history_text)
+        if cache_key is not None:
+            with _INTENT_CACHE_LOCK:
+                _INTENT_CACHE[cache_key] = (time.monotonic() + INTENT_CACHE_TTL, intent)
+                _INTENT_CACHE.move_to_end(cache_key)
+                while len(_INTENT_CACHE) > INTENT_CACHE_MAX_SIZE:
+                    _INTENT_CACHE.popitem(last=False)
         return intent
     except Exception as e:
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.error(f"[TEACHER] 意图识别失败: {e}")
         return "chat"
 
 
+@lru_cache(maxsize=1)
 def get_local_ip():
-    """获取本机IP地址"""
+    """获取本机IP地址（结果在进程内缓存，只在首次调用时探测一次）"""
     import socket
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -156,6 +232,22 @@ def class_data_manager():
 
 # ==================== 教师端备课API ====================
 
+def _chat_reply(user_text: str, conversation_history: List[dict]):
+    """闲聊：直接生成回复（非流式接口），不需要实体抽取参数"""
+    if DEBUG_AI:
+        logger.info("[TEACHER] 识别为闲聊，直接生成回复")
+    params = {"plan_type": "chat", "conversation_history": conversation_history}
+    response_text = generate_plan(build_plan_messages([], params, conversation_history, user_text))
+    conversation_history.append({"role": "user", "content": user_text})
+    conversation_history.append({"role": "assistant", "content": response_text})
+    return jsonify({
+        'success': True,
+        'response': response_text,
+        'conversation_history': conversation_history,
+        'is_chat': True
+    })
+
+
 @app.route('/api/teacher/plan', methods=['POST'])
 def teacher_plan():
     """
@@ -181,24 +273,40 @@ def teacher_plan():
 
         # 记录用户输入
         logger.info(f"[用户输入] {user_text}")
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.debug(f"[TEACHER] 收到请求: user_text={user_text}, history_len={len(conversation_history)}")
 
+        # 纯打招呼/致谢本地即可判断为闲聊，不提交实体抽取
+        if _local_plan_type(user_text) == "chat":
+            return _chat_reply(user_text, conversation_history)
+
+        # 对话历史只格式化一次，意图识别和实体抽取共用
+        history_text = format_history(conversation_history)
+
+        # 实体抽取（内部会进行班级检测）不依赖意图，先提交到后台与意图识别并行
+        entities_future = _AI_EXECUTOR.submit(extract_entities_llm, user_text, conversation_history, history_text=history_text)
+
         # 使用大模型进行意图识别
-        plan_type = detect_plan_type(user_text, conversation_history)
+        plan_type = detect_plan_type(user_text, conversation_history, history_text)
 
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.info(f"[TEACHER] 意图识别: plan_type={plan_type}")
 
-        # 实体抽取（内部会进行班级检测）
+        # 闲聊不需要实体抽取结果，不等待（尚未开始时直接取消）
+        if plan_type == "chat":
+            entities_future.cancel()
+            return _chat_reply(user_text, conversation_history)
+
+        # 等待实体抽取结果，再按意图检查缺失字段（检测到班级时直接使用预填充参数，不缺字段）
         try:
-            params, missing = collect_entities_llm(user_text, conversation_history, plan_type)
+            params, is_class = entities_future.result()
+            missing = [] if is_class else compute_missing_fields(plan_type, params)
             # 记录收集到的信息
-            logger.debug(f"[信息收集] 参数: {json.dumps(params, ensure_ascii=False)}")
-            if os.getenv('DEBUG_AI','1')=='1':
+            logger.debug("[信息收集] 参数: %s", LazyJson(params))
+            if DEBUG_AI:
                 logger.info(f"[TEACHER] 实体抽取: params={params}, missing={missing}")
         except Exception as e:
-            if os.getenv('DEBUG_AI','1')=='1':
+            if DEBUG_AI:
                 logger.error(f"[TEACHER] 实体抽取失败: {e}")
             return jsonify({'success': False, 'message': f'实体抽取失败: {e}'}), 500
 
@@ -213,44 +321,17 @@ def teacher_plan():
         params["plan_type"] = plan_type
         params["conversation_history"] = conversation_history
 
-        # 如果是闲聊，直接生成回复
-        if plan_type == "chat":
-            if os.getenv('DEBUG_AI','1')=='1':
-                logger.info("[TEACHER] 识别为闲聊，直接生成回复")
-            response_text = generate_plan([], params, user_text, need_guidance=False)
-            conversation_history.append({"role": "user", "content": user_text})
-            conversation_history.append({"role": "assistant", "content": response_text})
-            return jsonify({
-                'success': True,
-                'response': response_text,
-                'conversation_history': conversation_history,
-                'is_chat': True
-            })
-
-        # 判断是否需要引导
-        need_guidance = False
-        missing_fields = []
-
-        if plan_type == "sports_meeting":
-            # 全员运动会：需要操场条件、年级、人数等信息
-            semantic_query = params.get("semantic_query")
-
-            if not params.get("semantic_query"):
-                need_guidance = True
-                missing_fields.append("semantic_query")
-        elif plan_type == "lesson_plan":
-            # 课课练：需要班级或薄弱项，满足任一即可
-            has_grades = bool(params.get("grades_query"))
-            has_weaknesses = bool(params.get("trained_weaknesses"))
-            if not has_grades or not has_weaknesses:
-                need_guidance = True
-                missing_fields.extend(["grades_query", "trained_weaknesses"])
+        # 判断是否需要引导（按覆盖后的参数重新检查关键字段）
+        missing_fields = compute_missing_fields(plan_type, params)
+        need_guidance = bool(missing_fields)
 
         # 如果需要引导，生成引导语
         if need_guidance:
-            if os.getenv('DEBUG_AI','1')=='1':
+            if DEBUG_AI:
                 logger.info(f"[TEACHER] 需要引导，缺失字段: {missing_fields}")
-            guidance_text = generate_plan([], params, user_text, need_guidance=True)
+            guidance_text = generate_plan(
+                build_plan_messages([], params, conversation_history, user_text, missing_fields, need_guidance=True)
+            )
             conversation_history.append({"role": "user", "content": user_text})
             conversation_history.append({"role": "assistant", "content": guidance_text})
             return jsonify({
@@ -285,18 +366,17 @@ def teacher_plan():
                 }
                 results = call_lesson_plan_search(SEARCH_BASE_URL, payload)
 
-            if os.getenv('DEBUG_AI','1')=='1':
+            if DEBUG_AI:
                 logger.debug(f"[TEACHER] 检索结果数量: {len(results)}")
-                logger.info("====== 检索结果原始数据 ======")
-                logger.info(json.dumps(results, ensure_ascii=False, indent=2))
-                logger.info("====== 检索结果结束 ======")
+            if DEBUG_SEARCH_DUMP:
+                logger.info("====== 检索结果原始数据 ======\n%s\n====== 检索结果结束 ======", LazyJson(results, indent=2))
         except Exception as e:
-            if os.getenv('DEBUG_AI','1')=='1':
+            if DEBUG_AI:
                 logger.error(f"[TEACHER] 检索失败: {e}")
             results = []
 
         # 生成方案
-        response_text = generate_plan(results, params, user_text, need_guidance=False)
+        response_text = generate_plan(build_plan_messages(results, params, conversation_history, user_text))
 
         # 更新对话历史
         conversation_history.append({"role": "user", "content": user_text})
@@ -311,11 +391,124 @@ def teacher_plan():
         })
 
     except Exception as e:
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.error(f"[TEACHER] 教师端备课失败: {e}")
         return jsonify({'success': False, 'message': f'教师端备课失败: {str(e)}'}), 500
 
 
+# 流式方案输出是否gzip压缩（STREAM_GZIP=1开启，仅对声明支持gzip的客户端生效）
+STREAM_GZIP = os.getenv('STREAM_GZIP', '0') == '1'
+
+
+def _gzip_text_stream(chunks):
+    """逐块gzip压缩文本流，每块后同步刷新，保证客户端能及时解压出已生成的内容"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _text_stream_response(chunks) -> Response:
+    """构造流式纯文本响应，开启STREAM_GZIP且客户端支持时按gzip编码输出"""
+    if STREAM_GZIP and 'gzip' in request.accept_encodings:
+        resp = Response(_gzip_text_stream(chunks), mimetype='text/plain; charset=utf-8')
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+    return Response(chunks, mimetype='text/plain; charset=utf-8')
+
+
+def _search_plan_results(plan_type: str, params: Dict, user_text: str) -> List[dict]:
+    """按意图调用对应的检索接口，检索失败时返回空结果"""
+    try:
+        if plan_type == "sports_meeting":
+            # 全员运动会检索
+            semantic_with_text = f"{params.get('semantic_query', '')}{params.get('project_name', '')} {user_text}".strip()
+            payload = {
+                "semantic_query": semantic_with_text,
+                "count_query": str(params.get("count_query") or ""),
+                "grades_query": str(params.get("grades_query") or ""),
+                "top_k": int(params.get("top_k") or 5),
+            }
+            if DEBUG_AI:
+                logger.debug(f"[TEACHER] 流式接口：使用全员运动会检索 payload={payload}")
+            results = call_sports_meeting_search(SEARCH_BASE_URL, payload)
+            if DEBUG_AI:
+                logger.debug(f"[TEACHER] 流式接口：✅ 全员运动会检索成功，返回 {len(results)} 条")
+            if DEBUG_SEARCH_DUMP:
+                logger.info("====== 检索结果原始数据 ======\n%s\n====== 检索结果结束 ======", LazyJson(results, indent=2))
+        elif plan_type == "lesson_plan":
+            trained_weaknesses = params.get("trained_weaknesses") or ""
+            if trained_weaknesses.strip() == "无要求":
+                trained_weaknesses = ""
+            # 课课练检索
+            payload = {
+                "semantic_query": params.get("semantic_query") or "",
+                "count_query": str(params.get("count_query") or ""),
+                "grades_query": str(params.get("grades_query") or ""),
+                "trained_weaknesses": trained_weaknesses,
+                "top_k": int(params.get("top_k") or 5),
+            }
+            if DEBUG_AI:
+                logger.debug(f"[TEACHER] 流式接口：调用检索 payload={payload}")
+                logger.debug(f"[TEACHER] 流式接口：🚀 开始调用检索接口 {SEARCH_BASE_URL}/extended-search/hybrid")
+            results = call_lesson_plan_search(SEARCH_BASE_URL, payload)
+            if DEBUG_AI:
+                logger.debug(f"[TEACHER] 流式接口：✅ 检索接口调用成功，返回 {len(results)} 条")
+            if DEBUG_SEARCH_DUMP:
+                logger.info("====== 检索结果原始数据 ======\n%s\n====== 检索结果结束 ======", LazyJson(results, indent=2))
+        else:
+            results = []
+    except Exception as e:
+        if DEBUG_AI:
+            logger.error(f"[TEACHER] 流式接口：检索失败，使用空结果兜底: {e}")
+        results = []
+    return results
+
+
+def _chat_reply_stream(user_text: str):
+    """闲聊：流式生成友好回复，不需要实体抽取参数"""
+    try:
+        model = get_ai_model()
+        chat_messages = [
+            {"role": "system", "content": TEACHER_SYSTEM_PROMPT},
+            {"role": "user", "content": f"用户说：{user_text}\n\n请用友好、简洁的方式回复用户。如果是询问功能，可以介绍你可以帮助生成课课练备课方案和全员运动会方案。"}
+        ]
+        stream = model.client.chat.completions.create(
+            model=model.model,
+            messages=chat_messages,
+            max_tokens=200,
+            temperature=0.7,
+            stream=True,
+        )
+        yield from iter_stream_text(stream)
+    except Exception as e:
+        if DEBUG_AI:
+            logger.error(f"[TEACHER] 流式接口：闲聊回复生成失败: {e}")
+        yield "您好！我是AI备课助理。我可以帮您生成课课练备课方案和全员运动会方案。请告诉我您的需求。"
+
+
+# 方案流开头的状态行：以STREAM_STATUS_MARK开头、换行结尾，页面只作为提示显示，不计入方案正文和对话历史
+STREAM_STATUS_MARK = "\x1e"
+# 检索未完成时每隔多少秒再发送一条状态行，避免连接长时间没有数据被代理断开
+STREAM_HEARTBEAT_INTERVAL = float(os.getenv('STREAM_HEARTBEAT_INTERVAL', '1.5'))
+
+
+def _stream_status_line(text: str) -> str:
+    """构造一条方案流状态行"""
+    return f"{STREAM_STATUS_MARK}{text}\n"
+
+
+def _search_status_text(plan_type: str, params: Dict) -> str:
+    """检索开始时的状态提示，只由已收集的参数生成"""
+    scenario = "全员运动会" if plan_type == "sports_meeting" else "课课练"
+    grades = str(params.get("grades_query") or "").strip()
+    target = f"{grades}年级" if grades.isdigit() else ""
+    return f"正在检索{target}{scenario}相关资料…"
+
+
 @app.route('/api/teacher/plan/stream', methods=['POST'])
 def teacher_plan_stream():
     """
@@ -337,25 +530,43 @@ def teacher_plan_stream():
 
         # 记录用户输入
         logger.info(f"[用户输入] {user_text}")
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.debug(f"[TEACHER] 流式接口收到请求: user_text={user_text}")
 
+        # 纯打招呼/致谢本地即可判断为闲聊，不提交实体抽取
+        if _local_plan_type(user_text) == "chat":
+            return _text_stream_response(_chat_reply_stream(user_text))
+
+        # 对话历史只格式化一次，意图识别和实体抽取共用
+        history_text = format_history(conversation_history)
+
+        # 实体抽取（内部会进行班级检测）不依赖意图，先提交到后台与意图识别并行
+        entities_future = _AI_EXECUTOR.submit(extract_entities_llm, user_text, conversation_history, history_text=history_text)
+
         # 使用大模型进行意图识别
-        plan_type = detect_plan_type(user_text, conversation_history)
+        plan_type = detect_plan_type(user_text, conversation_history, history_text)
 
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.info(f"[TEACHER] 流式接口：意图识别: plan_type={plan_type}")
 
-        # 实体抽取（内部会进行班级检测）
-        params, missing = collect_entities_llm(user_text, conversation_history, plan_type)
+        # 如果是闲聊，直接生成友好回复（流式）；不需要实体抽取结果，不等待（尚未开始时直接取消）
+        if plan_type == "chat":
+            entities_future.cancel()
+            return _text_stream_response(_chat_reply_stream(user_text))
+
+        # 等待实体抽取结果，再按意图检查缺失字段（检测到班级时直接使用预填充参数，不缺字段）
+        params, is_class = entities_future.result()
+        missing = [] if is_class else compute_missing_fields(plan_type, params)
 
         # 记录收集到的信息
-        logger.debug(f"[信息收集] 参数: {json.dumps(params, ensure_ascii=False)}")
+        logger.debug("[信息收集] 参数: %s", LazyJson(params))
 
         # 应用显式覆盖（可能没啥用？）
         for k in ['semantic_query', 'count_query', 'grades_query', 'trained_weaknesses', 'top_k']:
             if k in override_params and override_params[k] not in (None, ''):
                 params[k] = override_params[k]
+                if k in missing:
+                    missing.remove(k)
 
         # 添加意图类型到参数中
         params["plan_type"] = plan_type
@@ -365,7 +576,7 @@ def teacher_plan_stream():
         need_guidance = bool(missing)
         # # 如果是闲聊，直接生成友好回复（流式）
         # if plan_type == "chat":
-        #     if os.getenv('DEBUG_AI','1')=='1':
+        #     if DEBUG_AI:
         #         logger.debug("[TEACHER] 流式接口：识别为闲聊，直接生成回复")
         #     need_guidance = False
         #     missing_fields = []
@@ -379,63 +590,26 @@ def teacher_plan_stream():
         #     missing_fields = []
         #     if plan_type == "sports_meeting":
         #         # 全员运动会：需要操场条件、年级、人数等信息
-        #         if os.getenv('DEBUG_AI','1')=='1':
+        #         if DEBUG_AI:
         #             logger.debug(f"[TEACHER] 流式接口：全员运动会场景，检查必要字段 - semantic={semantic_query}, grades={grades_query}, count={count_query}")
         #         if not semantic_query:
         #             missing_fields.append('semantic_query')
 
-        #         if missing_fields and os.getenv('DEBUG_AI','1')=='1':
+        #         if missing_fields and DEBUG_AI:
         #             logger.debug(f"[TEACHER] 流式接口：⚠️ 全员运动会场景信息不全，进入引导流程，缺失={missing_fields}")
         #     elif plan_type == "lesson_plan":
         #         # 课课练：需要班级（grades_query）或弱项（trained_weaknesses），满足任一即可
-        #         if os.getenv('DEBUG_AI','1')=='1':
+        #         if DEBUG_AI:
         #             logger.debug(f"[TEACHER] 流式接口：课课练场景，检查必要字段 - grades={grades_query}, trained_weaknesses={trained_weaknesses_value}")
                 
         #         if not grades_query or not trained_weaknesses_value:
         #             missing_fields.append('grades_query_or_trained_weaknesses')
 
-        #         if missing_fields and os.getenv('DEBUG_AI','1')=='1':
+        #         if missing_fields and DEBUG_AI:
         #             logger.debug("[TEACHER] 流式接口：⚠️ 课课练场景信息不全（缺少班级或弱项），进入引导流程")
 
         #     need_guidance = bool(missing_fields)
 
-        # 如果是闲聊，直接生成友好回复（流式）
-        if plan_type == "chat":
-            def chat_stream():
-                try:
-                    model = OptimizedAIModel()
-                    chat_messages = [
-                        {"role": "system", "content": TEACHER_SYSTEM_PROMPT},
-                        {"role": "user", "content": f"用户说：{user_text}\n\n请用友好、简洁的方式回复用户。如果是询问功能，可以介绍你可以帮助生成课课练备课方案和全员运动会方案。"}
-                    ]
-                    stream = model.client.chat.completions.create(
-                        model=model.model,
-                        messages=chat_messages,
-                        max_tokens=200,
-                        temperature=0.7,
-                        stream=True,
-                    )
-                    for event in stream:
-                        try:
-                            delta = event.choices[0].delta
-                            content = getattr(delta, "content", None)
-                            if content:
-                                yield content
-                        except Exception:
-                            chunk = None
-                            try:
-                                chunk = event["choices"][0]["delta"].get("content")
-                            except Exception:
-                                pass
-                            if chunk:
-                                yield chunk
-                except Exception as e:
-                    if os.getenv('DEBUG_AI','1')=='1':
-                        logger.error(f"[TEACHER] 流式接口：闲聊回复生成失败: {e}")
-                    yield "您好！我是AI备课助理。我可以帮您生成课课练备课方案和全员运动会方案。请告诉我您的需求。"
-
-            return Response(chat_stream(), mimetype='text/plain; charset=utf-8')
-
         if need_guidance:
             # 信息不全，使用generate_plan_stream生成引导语
             # collected_so_far = {
@@ -450,104 +624,71 @@ def teacher_plan_stream():
             #     collected_so_far['trained_weaknesses'] = params.get('trained_weaknesses') or ''
 
             try:
-                if os.getenv('DEBUG_AI','1')=='1':
+                if DEBUG_AI:
                     logger.debug("[TEACHER] 流式接口：信息不全，调用generate_plan_stream生成引导语(流式)...")
 
+                # 引导语的messages在请求线程中构造好，流式生成过程中只剩模型调用
+                guidance_messages = build_plan_messages([], params, conversation_history, user_text, missing, need_guidance=True)
+
                 def guidance_stream():
                     ask_chunks = []
                     try:
-                        for chunk in generate_plan_stream([], params,conversation_history, user_text,missing, need_guidance=True):
+                        for chunk in generate_plan_stream(guidance_messages):
                             ask_chunks.append(chunk)
                             yield chunk
 
                         final_ask = "".join(ask_chunks).strip()
 
-                        if os.getenv('DEBUG_AI','1')=='1':
+                        if DEBUG_AI:
                             logger.debug(f"[TEACHER] 流式接口：引导语推送完成，长度={len(final_ask)}")
                     except Exception as stream_err:
-                        if os.getenv('DEBUG_AI','1')=='1':
+                        if DEBUG_AI:
                             logger.debug(f"[TEACHER] 流式接口：引导语流式推送异常: {stream_err}")
                         yield f"[引导流错误] {stream_err}"
 
-                resp = Response(guidance_stream(), mimetype='text/plain; charset=utf-8')
+                resp = _text_stream_response(guidance_stream())
                 resp.headers['X-Need-More-Info'] = '1'
                 # HTTP响应头只能使用ASCII字符，需要将中文转义为\uXXXX格式
                 resp.headers['X-Collected-Params'] = json.dumps(params, ensure_ascii=True)
                 return resp
             except Exception as e:
-                if os.getenv('DEBUG_AI','1')=='1':
+                if DEBUG_AI:
                     logger.error(f"[TEACHER] 流式接口：引导语流式生成失败，使用兜底提示。错误: {e}")
 
                 def fallback_stream():
                     yield "请说明需要重点提升的薄弱项（如：速度/力量/柔韧/耐力/机能/形态）"
 
-                resp = Response(fallback_stream(), mimetype='text/plain; charset=utf-8')
+                resp = _text_stream_response(fallback_stream())
                 resp.headers['X-Need-More-Info'] = '1'
                 # HTTP响应头只能使用ASCII字符，需要将中文转义为\uXXXX格式
                 resp.headers['X-Collected-Params'] = json.dumps(params, ensure_ascii=True)
                 return resp
 
-        # 调用检索接口
-        try:
-            if plan_type == "sports_meeting":
-                # 全员运动会检索
-                semantic_with_text = f"{params.get('semantic_query', '')}{params.get('project_name', '')} {user_text}".strip()
-                payload = {
-                    "semantic_query": semantic_with_text,
-                    "count_query": str(params.get("count_query") or ""),
-                    "grades_query": str(params.get("grades_query") or ""),
-                    "top_k": int(params.get("top_k") or 5),
-                }
-                if os.getenv('DEBUG_AI','1')=='1':
-                    logger.debug(f"[TEACHER] 流式接口：使用全员运动会检索 payload={payload}")
-                results = call_sports_meeting_search(SEARCH_BASE_URL, payload)
-                if os.getenv('DEBUG_AI','1')=='1':
-                    logger.debug(f"[TEACHER] 流式接口：✅ 全员运动会检索成功，返回 {len(results)} 条")
-                    logger.info("====== 检索结果原始数据 ======")
-                    logger.info(json.dumps(results, ensure_ascii=False, indent=2))
-                    logger.info("====== 检索结果结束 ======")
-            elif plan_type == "lesson_plan":
-                trained_weaknesses = params.get("trained_weaknesses") or ""
-                if trained_weaknesses.strip() == "无要求":
-                    trained_weaknesses = ""
-                # 课课练检索
-                payload = {
-                    "semantic_query": params.get("semantic_query") or "",
-                    "count_query": str(params.get("count_query") or ""),
-                    "grades_query": str(params.get("grades_query") or ""),
-                    "trained_weaknesses": trained_weaknesses,
-                    "top_k": int(params.get("top_k") or 5),
-                }
-                if os.getenv('DEBUG_AI','1')=='1':
-                    logger.debug(f"[TEACHER] 流式接口：调用检索 payload={payload}")
-                    logger.debug(f"[TEACHER] 流式接口：🚀 开始调用检索接口 {SEARCH_BASE_URL}/extended-search/hybrid")
-                results = call_lesson_plan_search(SEARCH_BASE_URL, payload)
-                if os.getenv('DEBUG_AI','1')=='1':
-                    logger.debug(f"[TEACHER] 流式接口：✅ 检索接口调用成功，返回 {len(results)} 条")
-                    logger.info("====== 检索结果原始数据 ======")
-                    logger.info(json.dumps(results, ensure_ascii=False, indent=2))
-                    logger.info("====== 检索结果结束 ======")
-            else:
-                results = []
-        except Exception as e:
-            if os.getenv('DEBUG_AI','1')=='1':
-                logger.error(f"[TEACHER] 流式接口：检索失败，使用空结果兜底: {e}")
-            results = []
-
         # 流式生成方案
         def generate():
+            # 检索放到后台线程，先输出状态行：响应头随第一块数据发出，客户端不必等检索完成才收到响应
+            search_future = _AI_EXECUTOR.submit(_search_plan_results, plan_type, params, user_text)
+            yield _stream_status_line(_search_status_text(plan_type, params))
+            while True:
+                try:
+                    results = search_future.result(timeout=STREAM_HEARTBEAT_INTERVAL)
+                    break
+                except FutureTimeoutError:
+                    yield _stream_status_line("仍在检索，请稍候…")
+
             try:
-                for chunk in generate_plan_stream(results, params,conversation_history, user_text, need_guidance=False):
+                plan_messages = build_plan_messages(results, params, conversation_history, user_text)
+                for chunk in generate_plan_stream(plan_messages):
                     yield chunk
             except Exception as e:
-                if os.getenv('DEBUG_AI','1')=='1':
+                if DEBUG_AI:
                     logger.error(f"[TEACHER] 流式生成失败: {e}")
                 yield f"\n\n生成失败: {str(e)}"
 
-        return Response(generate(), mimetype='text/plain; charset=utf-8')
+        return _text_stream_response(generate())
 
     except Exception as e:
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.error(f"[TEACHER] 流式生成失败: {e}")
         return jsonify({'success': False, 'message': f'流式生成失败: {str(e)}'}), 500
 
@@ -589,11 +730,8 @@ def upload_class_data():
                 'message': '请选择文件'
             }), 400
 
-        # 读取文件内容
-        file_content = file.read()
-
-        # 分析数据
-        result = analyze_uploaded_file(file_content, class_name)
+        # 分析数据（直接解析上传文件流，不再先读成一份完整的bytes）
+        result = analyze_uploaded_file(file.stream, class_name)
 
         if result.get('success'):
             return jsonify({
@@ -648,16 +786,10 @@ def upload_class_data_stream():
                 'message': '请选择文件'
             }), 400
 
-        # 读取文件内容
-        file_content = file.read()
-
         def generate():
             try:
-                import pandas as pd
-                import io
-
-                # 读取Excel文件
-                df = pd.read_excel(io.BytesIO(file_content))
+                # 读取Excel文件（直接解析上传文件流；只解析分析需要的列，等级列直接转为Categorical）
+                df = read_class_excel(file.stream)
 
                 # 使用大模型流式分析
                 profile = None
@@ -666,26 +798,30 @@ def upload_class_data_stream():
                     if isinstance(chunk, tuple) and len(chunk) == 2 and chunk[0] == "__PROFILE__":
                         # 这是最终的profile字典
                         profile = chunk[1]
+                    elif isinstance(chunk, tuple) and len(chunk) == 2 and chunk[0] == "__AI_TOKEN__":
+                        # AI流式生成的片段
+                        yield sse_event({'type': 'ai_token', 'content': chunk[1]})
                     elif isinstance(chunk, str):
                         # 流式输出分析过程
-                        yield f"data: {json.dumps({'type': 'progress', 'content': chunk}, ensure_ascii=False)}\n\n"
+                        yield sse_event({'type': 'progress', 'content': chunk})
 
                 # 保存配置
                 if profile:
                     update_class_profile(class_name, profile)
-                    yield f"data: {json.dumps({'type': 'success', 'profile': profile, 'message': '✅ 分析完成并已保存！'}, ensure_ascii=False)}\n\n"
+                    yield sse_event({'type': 'success', 'profile': profile, 'message': '✅ 分析完成并已保存！'})
                 else:
-                    yield f"data: {json.dumps({'type': 'error', 'message': '❌ 分析失败：未获取到分析结果'}, ensure_ascii=False)}\n\n"
+                    yield sse_event({'type': 'error', 'message': '❌ 分析失败：未获取到分析结果'})
 
-                yield "data: [DONE]\n\n"
+                yield SSE_DONE
 
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                yield f"data: {json.dumps({'type': 'error', 'message': f'❌ 分析失败: {str(e)}'}, ensure_ascii=False)}\n\n"
-                yield "data: [DONE]\n\n"
+                yield sse_event({'type': 'error', 'message': f'❌ 分析失败: {str(e)}'})
+                yield SSE_DONE
 
-        return Response(generate(), mimetype='text/event-stream')
+        # 生成器在视图返回后才执行，需保持请求上下文，上传文件流在流式输出结束前不会被关闭
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
     except Exception as e:
         return jsonify({
@@ -784,6 +920,189 @@ def delete_class_profile_api(class_name):
         }), 500
 
 
+# Excel表头样式：与pandas.to_excel默认表头一致（加粗、细边框、水平居中）
+_EXCEL_HEADER_FONT = Font(bold=True)
+_EXCEL_HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+_EXCEL_HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+
+def _append_excel_sheet(wb, title: str, header: List[str], rows: List[list]):
+    """向write_only模式的工作簿追加一个工作表：带样式的表头 + 数据行"""
+    ws = wb.create_sheet(title)
+    header_cells = []
+    for name in header:
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = _EXCEL_HEADER_FONT
+        cell.border = _EXCEL_HEADER_BORDER
+        cell.alignment = _EXCEL_HEADER_ALIGNMENT
+        header_cells.append(cell)
+    ws.append(header_cells)
+    for row in rows:
+        ws.append(row)
+
+
+# 学生编号可能使用的字段，按优先级排列
+STUDENT_ID_KEYS = ('学生编号', '学号', '编号')
+
+
+def _student_report_rows(students: List[Dict]) -> List[List[str]]:
+    """
+    生成报告中的学生行：[学生编号, 姓名, 性别]（Excel和Word报告共用）
+
+    学生编号字段只在该组第一条记录中探测一次（同一班级的记录由同一份Excel的列生成，字段相同），
+    逐行只在实际存在的字段间按优先级回退；没有姓名时使用"学生X"。
+    """
+    id_keys = [key for key in STUDENT_ID_KEYS if key in students[0]] if students else []
+    rows = []
+    for student in students:
+        student_id = ''
+        for key in id_keys:
+            student_id = student.get(key, '')
+            if student_id:
+                break
+        student_name = student.get('姓名', '')
+        student_index = student.get('序号', '')
+
+        # 如果没有姓名，使用"学生X"
+        if not student_name and student_index:
+            student_name = f'学生{student_index}'
+
+        rows.append([str(student_id) if student_id else '', student_name, student.get('性别', '')])
+    return rows
+
+
+def build_class_excel(class_name: str, profile: Dict) -> bytes:
+    """根据班级配置生成Excel文件内容（班级信息、学生分组、体测统计三个工作表）"""
+    # 创建Excel文件（write_only模式逐行写出，不构造DataFrame，也不在内存中保留整个工作簿的单元格对象）
+    wb = Workbook(write_only=True)
+
+    # Sheet 1: 班级基本信息
+    _append_excel_sheet(wb, '班级信息', ['班级名称', '年级', '薄弱项', '描述'], [[
+        class_name,
+        f"{profile.get('grades_query', '')}年级",
+        ', '.join(profile.get('weaknesses', [])),
+        profile.get('description', '')
+    ]])
+
+    # Sheet 2: 学生分组详情
+    if 'student_groups' in profile and profile['student_groups']:
+        all_students = []
+
+        for group_key, group_info in profile['student_groups'].items():
+            weakness_items = ', '.join(group_info.get('weakness_items', []))
+
+            if 'student_details' in group_info and group_info['student_details']:
+                all_students.extend(
+                    [group_key, weakness_items, *row]
+                    for row in _student_report_rows(group_info['student_details'])
+                )
+
+        if all_students:
+            _append_excel_sheet(wb, '学生分组', ['分组', '薄弱项目', '学生编号', '姓名', '性别'], all_students)
+
+    # Sheet 3: 各项体测统计（如果有的话）
+    if 'test_stats' in profile and profile['test_stats']:
+        stats_data = []
+        for item, stats in profile['test_stats'].items():
+            stats_data.append([
+                item,
+                stats.get('dimension', ''),
+                stats.get('excellent', 0),
+                stats.get('good', 0),
+                stats.get('pass', 0),
+                stats.get('fail', 0)
+            ])
+
+        if stats_data:
+            _append_excel_sheet(wb, '体测统计', ['体测项目', '维度', '优秀人数', '良好人数', '及格人数', '不及格人数'], stats_data)
+
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# 报告文档生成线程池：限制同时生成报告的数量，lxml序列化时会释放GIL；
+# 不使用进程池：fork多线程的服务进程可能把持有中的锁复制到子进程导致死锁，子进程中的日志也无法写出
+REPORT_POOL_WORKERS = 2
+REPORT_BUILD_TIMEOUT = 30
+_REPORT_POOL = None
+_REPORT_POOL_LOCK = threading.Lock()
+# 正在生成的报告：ETag -> Future，同一份报告的并发请求共用一次生成
+_REPORT_INFLIGHT: Dict[str, Future] = {}
+
+# 异步导出任务：job_id -> (Future, ETag, 报告类型, 班级名称, 创建时间)，结果被下载或超过TTL后清除
+REPORT_JOB_TTL = 300
+REPORT_JOB_MAX = 64
+_REPORT_JOBS: "OrderedDict[str, Tuple[Future, str, str, str, float]]" = OrderedDict()
+_REPORT_JOBS_LOCK = threading.Lock()
+
+
+# 报告格式版本：修改Excel/Word的生成逻辑时递增，使客户端缓存的旧ETag失效
+REPORT_FORMAT_VERSION = 2
+# 下载响应允许浏览器私有缓存的时间（秒），过期后携带If-None-Match重新验证
+REPORT_CACHE_MAX_AGE = 60
+
+
+def _report_etag(kind: str, class_name: str, profile: Dict) -> str:
+    """报告下载的ETag：由报告类型、班级名称和班级配置内容计算，配置不变时ETag不变"""
+    data = json_dumps_bytes([REPORT_FORMAT_VERSION, kind, class_name, profile], sort_keys=True)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _report_not_modified(etag: str):
+    """客户端缓存的报告仍有效（If-None-Match命中）时返回304响应，否则返回None"""
+    if not request.if_none_match.contains(etag):
+        return None
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f'private, max-age={REPORT_CACHE_MAX_AGE}'
+    return resp
+
+
+def _send_report(data: bytes, etag: str, mimetype: str, download_name: str):
+    """以附件形式返回报告文件，附带ETag和Cache-Control"""
+    resp = send_file(
+        BytesIO(data),
+        mimetype=mimetype,
+        as_attachment=True,
+        download_name=download_name,
+        etag=etag,
+    )
+    resp.headers['Cache-Control'] = f'private, max-age={REPORT_CACHE_MAX_AGE}'
+    return resp
+
+
+def _submit_report(builder, class_name: str, profile: Dict, etag: str) -> Future:
+    """
+    把builder(class_name, profile)提交到报告线程池（线程池首次使用时创建），返回Future
+
+    同一ETag的报告正在生成时直接返回已有的Future，不重复生成。
+    """
+    global _REPORT_POOL
+    with _REPORT_POOL_LOCK:
+        future = _REPORT_INFLIGHT.get(etag)
+        if future is not None:
+            return future
+        if _REPORT_POOL is None:
+            _REPORT_POOL = ThreadPoolExecutor(max_workers=REPORT_POOL_WORKERS, thread_name_prefix="report")
+        future = _REPORT_POOL.submit(builder, class_name, profile)
+        _REPORT_INFLIGHT[etag] = future
+    future.add_done_callback(lambda done: _forget_inflight_report(etag, done))
+    return future
+
+
+def _forget_inflight_report(etag: str, future: Future) -> None:
+    """报告生成结束后移出正在生成的表；该ETag已被新提交的Future占用时不动它"""
+    with _REPORT_POOL_LOCK:
+        if _REPORT_INFLIGHT.get(etag) is future:
+            del _REPORT_INFLIGHT[etag]
+
+
+def _build_report(builder, class_name: str, profile: Dict, etag: str) -> bytes:
+    """在报告线程池中生成报告并等待返回文件内容"""
+    return _submit_report(builder, class_name, profile, etag).result(timeout=REPORT_BUILD_TIMEOUT)
+
+
 @app.route('/api/class_data/download/<class_name>', methods=['GET'])
 def download_class_excel(class_name):
     """
@@ -807,76 +1126,20 @@ def download_class_excel(class_name):
 
         profile = profiles[class_name]
 
-        # 创建Excel文件
-        output = BytesIO()
+        # 班级配置未变化时直接返回304，不重新生成文件
+        etag = _report_etag('excel', class_name, profile)
+        not_modified = _report_not_modified(etag)
+        if not_modified is not None:
+            return not_modified
 
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            # Sheet 1: 班级基本信息
-            basic_info = {
-                '班级名称': [class_name],
-                '年级': [f"{profile.get('grades_query', '')}年级"],
-                '薄弱项': [', '.join(profile.get('weaknesses', []))],
-                '描述': [profile.get('description', '')]
-            }
-            df_basic = pd.DataFrame(basic_info)
-            df_basic.to_excel(writer, sheet_name='班级信息', index=False)
-
-            # Sheet 2: 学生分组详情
-            if 'student_groups' in profile and profile['student_groups']:
-                all_students = []
-
-                for group_key, group_info in profile['student_groups'].items():
-                    weakness_items = ', '.join(group_info.get('weakness_items', []))
-
-                    if 'student_details' in group_info and group_info['student_details']:
-                        for student in group_info['student_details']:
-                            # 优先获取学生编号，尝试多个可能的字段
-                            student_id = student.get('学生编号', '') or student.get('学号', '') or student.get('编号', '')
-                            student_name = student.get('姓名', '')
-                            student_index = student.get('序号', '')
-
-                            # 如果没有姓名，使用"学生X"
-                            if not student_name and student_index:
-                                student_name = f'学生{student_index}'
-
-                            student_row = {
-                                '分组': group_key,
-                                '薄弱项目': weakness_items,
-                                '学生编号': str(student_id) if student_id else '',
-                                '姓名': student_name,
-                                '性别': student.get('性别', '')
-                            }
-                            all_students.append(student_row)
-
-                if all_students:
-                    df_students = pd.DataFrame(all_students)
-                    df_students.to_excel(writer, sheet_name='学生分组', index=False)
-
-            # Sheet 3: 各项体测统计（如果有的话）
-            if 'test_stats' in profile and profile['test_stats']:
-                stats_data = []
-                for item, stats in profile['test_stats'].items():
-                    stats_row = {
-                        '体测项目': item,
-                        '维度': stats.get('dimension', ''),
-                        '优秀人数': stats.get('excellent', 0),
-                        '良好人数': stats.get('good', 0),
-                        '及格人数': stats.get('pass', 0),
-                        '不及格人数': stats.get('fail', 0)
-                    }
-                    stats_data.append(stats_row)
-
-                if stats_data:
-                    df_stats = pd.DataFrame(stats_data)
-                    df_stats.to_excel(writer, sheet_name='体测统计', index=False)
-
-        output.seek(0)
+        # 在报告线程池中构建Excel文件
+        output = _build_report(build_class_excel, class_name, profile, etag)
 
         # 返回Excel文件
-        return send_file(
+        return _send_report(
             output,
+            etag,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
             download_name=f'{class_name}_配置.xlsx'
         )
 
@@ -887,6 +1150,175 @@ def download_class_excel(class_name):
         }), 500
 
 
+@lru_cache(maxsize=1)
+def _word_template_bytes() -> bytes:
+    """
+    Word报告的空白模板（首次调用时生成并缓存）
+
+    正文、标题和各级标题样式的字体统一设置为宋体（解决中文乱码问题），文档内容通过样式继承字体，
+    不必逐个run设置。每次下载从这份字节内容打开新文档，不再重复加载python-docx默认模板和设置样式。
+    """
+    doc = Document()
+    for style_name in ('Normal', 'Title', 'Heading 1', 'Heading 2'):
+        style = doc.styles[style_name]
+        style.font.name = '宋体'
+        r_fonts = style._element.rPr.rFonts
+        # 标题样式默认使用主题字体（主题属性优先于显式字体），需要去掉
+        for attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme'):
+            r_fonts.attrib.pop(qn(attr), None)
+        r_fonts.set(qn('w:eastAsia'), '宋体')
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def _append_word_table_rows(table, rows: List[List[str]]):
+    """
+    向Word表格批量追加数据行
+
+    先用python-docx生成一行带文本节点的原型行，之后每行只deepcopy原型并改写<w:t>的文本，
+    不再为每个单元格走cell.text（清空段落、重建p/r/t节点）。生成的XML与逐格赋值一致。
+    """
+    prototype_row = table.add_row()
+    for cell in prototype_row.cells:
+        cell.text = 'x'
+    prototype = prototype_row._tr
+    tbl = table._tbl
+    tbl.remove(prototype)
+
+    for values in rows:
+        tr = deepcopy(prototype)
+        tbl.append(tr)
+        for tc, t, value in zip(tr.tc_lst, list(tr.iter(qn('w:t'))), values):
+            if any(ch in value for ch in '\t\n\r'):
+                # 制表符/换行需要python-docx转换成<w:tab/>、<w:br/>，这种单元格仍按常规方式赋值
+                _Cell(tc, table).text = value
+            elif not value:
+                t.getparent().remove(t)
+            else:
+                t.text = value
+                if len(value.strip()) < len(value):
+                    t.set(qn('xml:space'), 'preserve')
+
+
+def build_class_word(class_name: str, profile: Dict) -> bytes:
+    """根据班级配置生成Word报告内容（班级基本信息、学生分组详情、体测统计）"""
+    # 基于预先生成的模板创建Word文档（各样式已设置中文字体，以下内容不再逐个run设置字体）
+    doc = Document(BytesIO(_word_template_bytes()))
+
+    # 添加标题
+    title = doc.add_heading(f'{class_name} 体测数据分析报告', 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    if title.runs:
+        title.runs[0].font.size = Pt(20)
+
+    # 添加空行
+    doc.add_paragraph()
+
+    # 1. 班级基本信息
+    doc.add_heading('一、班级基本信息', 1)
+
+    # 创建基本信息表格
+    table1 = doc.add_table(rows=4, cols=2)
+    table1.style = 'Light Grid Accent 1'
+
+    # 设置表头
+    cells = table1.rows[0].cells
+    cells[0].text = '班级名称'
+    cells[1].text = class_name
+
+    cells = table1.rows[1].cells
+    cells[0].text = '年级'
+    cells[1].text = f"{profile.get('grades_query', '')}年级"
+
+    cells = table1.rows[2].cells
+    cells[0].text = '薄弱项'
+    cells[1].text = ', '.join(profile.get('weaknesses', []))
+
+    cells = table1.rows[3].cells
+    cells[0].text = '分析描述'
+    cells[1].text = profile.get('description', '')
+
+    # 第一列加粗
+    for row in table1.rows:
+        if row.cells[0].paragraphs and row.cells[0].paragraphs[0].runs:
+            row.cells[0].paragraphs[0].runs[0].font.bold = True
+
+    doc.add_paragraph()
+
+    # 2. 学生分组详情
+    if 'student_groups' in profile and profile['student_groups']:
+        doc.add_heading('二、学生分组详情', 1)
+
+        for group_key, group_info in profile['student_groups'].items():
+            # 分组标题
+            doc.add_heading(f'{group_key}薄弱组（{group_info["count"]}人）', 2)
+
+            # 薄弱项目
+            weakness_items = ', '.join(group_info.get('weakness_items', []))
+            doc.add_paragraph(f'体测不及格项目：{weakness_items}')
+
+            # 学生列表表格
+            if 'student_details' in group_info and group_info['student_details']:
+                students = group_info['student_details']
+
+                # 创建表格（先只建表头行，学生行按原型行批量追加）
+                table2 = doc.add_table(rows=1, cols=3)
+                table2.style = 'Light List Accent 1'
+
+                # 表头
+                header_cells = table2.rows[0].cells
+                header_cells[0].text = '学生编号'
+                header_cells[1].text = '姓名'
+                header_cells[2].text = '性别'
+
+                # 表头样式
+                for cell in header_cells:
+                    if cell.paragraphs and cell.paragraphs[0].runs:
+                        cell.paragraphs[0].runs[0].font.bold = True
+                        cell.paragraphs[0].runs[0].font.size = Pt(11)
+
+                # 填充学生数据
+                _append_word_table_rows(table2, _student_report_rows(students))
+
+            doc.add_paragraph()
+
+    # 3. 体测统计
+    if 'test_stats' in profile and profile['test_stats']:
+        doc.add_heading('三、体测统计', 1)
+
+        stats = profile['test_stats']
+
+        # 创建统计表格（先只建表头行，数据行按原型行批量追加）
+        table3 = doc.add_table(rows=1, cols=6)
+        table3.style = 'Light Grid Accent 1'
+
+        # 表头
+        header_cells = table3.rows[0].cells
+        headers = ['体测项目', '维度', '优秀人数', '良好人数', '及格人数', '不及格人数']
+        for i, header in enumerate(headers):
+            header_cells[i].text = header
+            if header_cells[i].paragraphs and header_cells[i].paragraphs[0].runs:
+                header_cells[i].paragraphs[0].runs[0].font.bold = True
+
+        # 填充数据
+        _append_word_table_rows(table3, [
+            [
+                item,
+                stat.get('dimension', ''),
+                str(stat.get('excellent', 0)),
+                str(stat.get('good', 0)),
+                str(stat.get('pass', 0)),
+                str(stat.get('fail', 0)),
+            ]
+            for item, stat in stats.items()
+        ])
+
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
 @app.route('/api/class_data/download_word/<class_name>', methods=['GET'])
 def download_class_word(class_name):
     """
@@ -910,183 +1342,20 @@ def download_class_word(class_name):
 
         profile = profiles[class_name]
 
-        # 创建Word文档
-        doc = Document()
+        # 班级配置未变化时直接返回304，不重新生成文件
+        etag = _report_etag('word', class_name, profile)
+        not_modified = _report_not_modified(etag)
+        if not_modified is not None:
+            return not_modified
 
-        # 设置默认字体为中文字体（解决乱码问题）
-        style = doc.styles['Normal']
-        style.font.name = '宋体'
-        style._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-        # 添加标题
-        title = doc.add_heading(f'{class_name} 体测数据分析报告', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        if title.runs:
-            title.runs[0].font.size = Pt(20)
-            title.runs[0].font.name = '宋体'
-            title.runs[0]._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-        # 添加空行
-        doc.add_paragraph()
-
-        # 1. 班级基本信息
-        heading1 = doc.add_heading('一、班级基本信息', 1)
-        for run in heading1.runs:
-            run.font.name = '宋体'
-            run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-        # 创建基本信息表格
-        table1 = doc.add_table(rows=4, cols=2)
-        table1.style = 'Light Grid Accent 1'
-
-        # 设置表头
-        cells = table1.rows[0].cells
-        cells[0].text = '班级名称'
-        cells[1].text = class_name
-
-        cells = table1.rows[1].cells
-        cells[0].text = '年级'
-        cells[1].text = f"{profile.get('grades_query', '')}年级"
-
-        cells = table1.rows[2].cells
-        cells[0].text = '薄弱项'
-        cells[1].text = ', '.join(profile.get('weaknesses', []))
-
-        cells = table1.rows[3].cells
-        cells[0].text = '分析描述'
-        cells[1].text = profile.get('description', '')
-
-        # 设置表格样式（添加字体设置）
-        for row in table1.rows:
-            for cell in row.cells:
-                for paragraph in cell.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.name = '宋体'
-                        run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-            # 第一列加粗
-            if row.cells[0].paragraphs and row.cells[0].paragraphs[0].runs:
-                row.cells[0].paragraphs[0].runs[0].font.bold = True
-
-        doc.add_paragraph()
-
-        # 2. 学生分组详情
-        if 'student_groups' in profile and profile['student_groups']:
-            heading2 = doc.add_heading('二、学生分组详情', 1)
-            for run in heading2.runs:
-                run.font.name = '宋体'
-                run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-            for group_key, group_info in profile['student_groups'].items():
-                # 分组标题
-                group_heading = doc.add_heading(f'{group_key}薄弱组（{group_info["count"]}人）', 2)
-                for run in group_heading.runs:
-                    run.font.name = '宋体'
-                    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-                # 薄弱项目
-                weakness_items = ', '.join(group_info.get('weakness_items', []))
-                p = doc.add_paragraph(f'体测不及格项目：{weakness_items}')
-                for run in p.runs:
-                    run.font.name = '宋体'
-                    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-                # 学生列表表格
-                if 'student_details' in group_info and group_info['student_details']:
-                    students = group_info['student_details']
-
-                    # 创建表格（表头 + 学生行）
-                    table2 = doc.add_table(rows=len(students) + 1, cols=3)
-                    table2.style = 'Light List Accent 1'
-
-                    # 表头
-                    header_cells = table2.rows[0].cells
-                    header_cells[0].text = '学生编号'
-                    header_cells[1].text = '姓名'
-                    header_cells[2].text = '性别'
-
-                    # 表头样式
-                    for cell in header_cells:
-                        if cell.paragraphs and cell.paragraphs[0].runs:
-                            cell.paragraphs[0].runs[0].font.bold = True
-                            cell.paragraphs[0].runs[0].font.size = Pt(11)
-                            cell.paragraphs[0].runs[0].font.name = '宋体'
-                            cell.paragraphs[0].runs[0]._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-                    # 填充学生数据
-                    for i, student in enumerate(students, start=1):
-                        row_cells = table2.rows[i].cells
-                        # 优先获取学生编号，尝试多个可能的字段
-                        student_id = student.get('学生编号', '') or student.get('学号', '') or student.get('编号', '')
-                        student_name = student.get('姓名', '')
-                        student_index = student.get('序号', '')
-
-                        # 如果没有姓名，使用"学生X"
-                        if not student_name and student_index:
-                            student_name = f'学生{student_index}'
-
-                        row_cells[0].text = str(student_id) if student_id else ''
-                        row_cells[1].text = student_name
-                        row_cells[2].text = student.get('性别', '')
-
-                        # 设置字体
-                        for cell in row_cells:
-                            for paragraph in cell.paragraphs:
-                                for run in paragraph.runs:
-                                    run.font.name = '宋体'
-                                    run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-                doc.add_paragraph()
-
-        # 3. 体测统计
-        if 'test_stats' in profile and profile['test_stats']:
-            heading3 = doc.add_heading('三、体测统计', 1)
-            for run in heading3.runs:
-                run.font.name = '宋体'
-                run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-            stats = profile['test_stats']
-
-            # 创建统计表格
-            table3 = doc.add_table(rows=len(stats) + 1, cols=6)
-            table3.style = 'Light Grid Accent 1'
-
-            # 表头
-            header_cells = table3.rows[0].cells
-            headers = ['体测项目', '维度', '优秀人数', '良好人数', '及格人数', '不及格人数']
-            for i, header in enumerate(headers):
-                header_cells[i].text = header
-                if header_cells[i].paragraphs and header_cells[i].paragraphs[0].runs:
-                    header_cells[i].paragraphs[0].runs[0].font.bold = True
-                    header_cells[i].paragraphs[0].runs[0].font.name = '宋体'
-                    header_cells[i].paragraphs[0].runs[0]._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-            # 填充数据
-            for i, (item, stat) in enumerate(stats.items(), start=1):
-                row_cells = table3.rows[i].cells
-                row_cells[0].text = item
-                row_cells[1].text = stat.get('dimension', '')
-                row_cells[2].text = str(stat.get('excellent', 0))
-                row_cells[3].text = str(stat.get('good', 0))
-                row_cells[4].text = str(stat.get('pass', 0))
-                row_cells[5].text = str(stat.get('fail', 0))
-
-                # 设置字体
-                for cell in row_cells:
-                    for paragraph in cell.paragraphs:
-                        for run in paragraph.runs:
-                            run.font.name = '宋体'
-                            run._element.rPr.rFonts.set(qn('w:eastAsia'), '宋体')
-
-        # 保存到BytesIO
-        output = BytesIO()
-        doc.save(output)
-        output.seek(0)
+        # 在报告线程池中构建Word文档
+        output = _build_report(build_class_word, class_name, profile, etag)
 
         # 返回Word文件
-        return send_file(
+        return _send_report(
             output,
+            etag,
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
             download_name=f'{class_name}_配置.docx'
         )
 
@@ -1097,6 +1366,129 @@ def download_class_word(class_name):
         }), 500
 
 
+# 异步导出支持的报告类型：类型 -> (生成函数, MIME类型, 文件扩展名)
+REPORT_KINDS = {
+    'excel': (build_class_excel, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'word': (build_class_word, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', 'docx'),
+}
+
+
+def _prune_report_jobs(now: float):
+    """清除超过TTL的导出任务，任务数超过上限时丢弃最早的任务（调用方需持有锁）"""
+    while _REPORT_JOBS:
+        job_id, (_, _, _, _, created) = next(iter(_REPORT_JOBS.items()))
+        if now - created <= REPORT_JOB_TTL and len(_REPORT_JOBS) <= REPORT_JOB_MAX:
+            break
+        _REPORT_JOBS.pop(job_id)
+
+
+@app.route('/api/class_data/report_job/<kind>/<class_name>', methods=['POST'])
+def create_report_job(kind, class_name):
+    """
+    创建异步导出任务：后台开始生成班级报告，立即返回任务ID
+
+    参数:
+        kind: 报告类型（excel 或 word）
+        class_name: 班级名称
+
+    返回:
+        {"success": True, "job_id": ...}，之后通过 GET /api/class_data/report_job/<job_id> 下载
+    """
+    try:
+        if kind not in REPORT_KINDS:
+            return jsonify({
+                "success": False,
+                "message": f"不支持的报告类型: {kind}"
+            }), 400
+
+        profiles = get_all_class_profiles()
+        if class_name not in profiles:
+            return jsonify({
+                "success": False,
+                "message": f"班级配置不存在: {class_name}"
+            }), 404
+
+        profile = profiles[class_name]
+        etag = _report_etag(kind, class_name, profile)
+        future = _submit_report(REPORT_KINDS[kind][0], class_name, profile, etag)
+
+        job_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with _REPORT_JOBS_LOCK:
+            _REPORT_JOBS[job_id] = (future, etag, kind, class_name, now)
+            _prune_report_jobs(now)
+
+        return jsonify({
+            "success": True,
+            "job_id": job_id
+        })
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"创建导出任务失败: {str(e)}"
+        }), 500
+
+
+@app.route('/api/class_data/report_job/<job_id>', methods=['GET'])
+def download_report_job(job_id):
+    """
+    下载异步导出任务的结果
+
+    返回:
+        生成完成时返回报告文件；仍在生成时返回202（{"status": "pending"}），客户端稍后重试
+    """
+    with _REPORT_JOBS_LOCK:
+        _prune_report_jobs(time.monotonic())
+        job = _REPORT_JOBS.get(job_id)
+        if job is not None and job[0].done():
+            _REPORT_JOBS.pop(job_id)
+
+    if job is None:
+        return jsonify({
+            "success": False,
+            "message": f"导出任务不存在或已过期: {job_id}"
+        }), 404
+
+    future, etag, kind, class_name, _ = job
+    if not future.done():
+        return jsonify({
+            "success": True,
+            "status": "pending"
+        }), 202
+
+    try:
+        output = future.result()
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"导出失败: {str(e)}"
+        }), 500
+
+    _, mimetype, ext = REPORT_KINDS[kind]
+    return _send_report(output, etag, mimetype=mimetype, download_name=f'{class_name}_配置.{ext}')
+
+
+# class_data目录的文件列表快照：(目录路径, 目录st_mtime_ns, 文件列表)
+# 目录下增删/重命名文件会更新目录mtime，目录未变化时直接复用上次的列表，不再重新遍历目录
+_CLASS_DATA_FILES = (None, None, [])
+_CLASS_DATA_FILES_LOCK = threading.Lock()
+
+
+def list_class_data_files(class_data_dir: Path) -> List[Path]:
+    """列出班级数据目录下的.xlsx和.xls文件，按目录mtime缓存列表"""
+    global _CLASS_DATA_FILES
+    mtime = class_data_dir.stat().st_mtime_ns
+    cached_dir, cached_mtime, files = _CLASS_DATA_FILES
+    if cached_dir == class_data_dir and cached_mtime == mtime:
+        return list(files)
+
+    with _CLASS_DATA_FILES_LOCK:
+        files = list(class_data_dir.glob("*.xlsx")) + list(class_data_dir.glob("*.xls"))
+        _CLASS_DATA_FILES = (class_data_dir, mtime, files)
+    return list(files)
+
+
 @app.route('/api/class_data/batch_analyze', methods=['POST'])
 def batch_analyze_class_data():
     """
@@ -1120,25 +1512,26 @@ def batch_analyze_class_data():
                 'message': 'class_data文件夹不存在'
             }), 404
 
-        excel_files = list(class_data_dir.glob("*.xlsx")) + list(class_data_dir.glob("*.xls"))
+        excel_files = list_class_data_files(class_data_dir)
 
         if max_count:
             excel_files = excel_files[:max_count]
 
+        # 各文件相互独立：未变化的文件直接读缓存，其余交给线程池并行分析
+        # （Web服务进程中不用spawn进程池：每个worker都要重新导入app模块，见analyze_class_files）
         results = []
-        for file_path in excel_files:
-            try:
-                result = analyze_class_file(file_path)
+        for file_path, result, error in analyze_class_files(excel_files, use_processes=False):
+            if error is None:
                 results.append({
                     'class_name': file_path.stem,
                     'success': True,
                     'data': result
                 })
-            except Exception as e:
+            else:
                 results.append({
                     'class_name': file_path.stem,
                     'success': False,
-                    'error': str(e)
+                    'error': error
                 })
 
         return jsonify({
